@@ -0,0 +1,450 @@
+"""Benchmarks of the pre-processing, labelizing, storage, aggregation and API hot paths
+
+Run them with `python -m benchmarks.bench run --sizes 1000,10000 --output current.json`,
+then flag regressions against a saved baseline with
+`python -m benchmarks.bench compare baseline.json current.json --threshold 0.1`.
+`python -m benchmarks.bench crossover` finds the batch size from which the columnar
+pre-processing is faster than the row by row one.
+Every size runs on a fresh sqlite database in a temporary directory.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import zlib
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from . import synthetic
+
+BENCH_REPEAT = 5
+# Articles labelized with the real model, it is orders of magnitude slower
+MODEL_SAMPLE_SIZE = 256
+# Articles pre-processed, labelized and stored together
+PIPELINE_CHUNK_SIZE = 5000
+REGRESSION_THRESHOLD = 0.1
+CROSSOVER_BATCH_SIZES = [10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+
+class StubTokenizer:
+    """Whitespace tokenizer hashing words into a small vocabulary"""
+
+    model_max_length = 512
+    vocab_size = 30000
+
+    def get_vocab(self) -> dict:
+        return {"stub": self.vocab_size}
+
+    def __call__(self, texts, truncation=True, max_length=512, **kwargs):
+        input_ids = [
+            [0]
+            + [
+                zlib.crc32(word.encode()) % self.vocab_size + 1 for word in text.split()
+            ][: max_length - 2]
+            + [0]
+            for text in texts
+        ]
+        return {
+            "input_ids": input_ids,
+            "attention_mask": [[1] * len(ids) for ids in input_ids],
+        }
+
+    def pad(self, encodings: list[dict], return_tensors: str = "np") -> dict:
+        import numpy as np
+
+        length = max(len(encoding["input_ids"]) for encoding in encodings)
+        return {
+            key: np.array(
+                [
+                    encoding[key] + [0] * (length - len(encoding[key]))
+                    for encoding in encodings
+                ]
+            )
+            for key in ("input_ids", "attention_mask")
+        }
+
+
+class StubDetector:
+    """Detector answering in constant time per token, to time everything but the model"""
+
+    revision = "stub"
+    tokenizer = StubTokenizer()
+
+    class config:
+        id2label = {0: "Human", 1: "ChatGPT"}
+        max_position_embeddings = 514
+
+    def predict_logits(self, encoded: dict):
+        import numpy as np
+
+        ids = encoded["input_ids"] * encoded["attention_mask"]
+        fake_logit = (ids % 7).mean(axis=-1) - 3
+        return np.stack([np.zeros_like(fake_logit), fake_logit], axis=-1)
+
+    def __call__(self, texts):
+        from processing import batch_inference
+
+        return batch_inference.classify_texts(
+            self, [texts] if isinstance(texts, str) else texts
+        )
+
+
+def _result(nb_items: int, seconds: float) -> dict:
+    return {
+        "items": nb_items,
+        "seconds": round(seconds, 6),
+        "items_per_second": round(nb_items / seconds, 1) if seconds else None,
+    }
+
+
+def _median_result(nb_items: int, run, repeat: int) -> dict:
+    durations = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        run()
+        durations.append(time.perf_counter() - started_at)
+    return _result(nb_items, statistics.median(durations))
+
+
+def bench_pipeline(size: int, seed: int, real_model: bool) -> tuple[dict, list[str]]:
+    """Time pre-processing, labelizing with the stub detector and storage over the corpus"""
+    from database import crud, database
+    from processing import labelize, model_registry, pre_process
+
+    detectors = [("stub-detector", StubDetector())]
+    seconds = {"pre_process": 0.0, "labelize_stub": 0.0, "batch_create_articles": 0.0}
+    counts = dict.fromkeys(seconds, 0)
+    article_ids = []
+    model_sample = []
+    pages = synthetic.generate_pages(size, seed)
+    db = database.SessionLocal()
+    try:
+        while True:
+            prepared_articles = []
+            started_at = time.perf_counter()
+            nb_raw_articles = 0
+            for keywords, response in pages:
+                nb_raw_articles += len(response["articles"])
+                prepared_articles += pre_process.select_and_prepare_articles(
+                    keywords, response["articles"]
+                )
+                if nb_raw_articles >= PIPELINE_CHUNK_SIZE:
+                    break
+            if not nb_raw_articles:
+                break
+            seconds["pre_process"] += time.perf_counter() - started_at
+            counts["pre_process"] += nb_raw_articles
+            # Duplicates are removed before labelizing, as in a sync
+            unique_articles = list(
+                {
+                    article["article_id"]: article for article in prepared_articles
+                }.values()
+            )
+            if real_model and len(model_sample) < MODEL_SAMPLE_SIZE:
+                model_sample += [
+                    dict(article)
+                    for article in unique_articles[
+                        : MODEL_SAMPLE_SIZE - len(model_sample)
+                    ]
+                ]
+            started_at = time.perf_counter()
+            labelize.labelize_articles(unique_articles, db=db, detectors=detectors)
+            seconds["labelize_stub"] += time.perf_counter() - started_at
+            counts["labelize_stub"] += len(unique_articles)
+            started_at = time.perf_counter()
+            crud.batch_create_articles(db, unique_articles)
+            seconds["batch_create_articles"] += time.perf_counter() - started_at
+            counts["batch_create_articles"] += len(unique_articles)
+            article_ids += [article["article_id"] for article in unique_articles]
+        results = {name: _result(counts[name], seconds[name]) for name in seconds}
+        if real_model:
+            started_at = time.perf_counter()
+            labelize.labelize_articles(
+                model_sample, db=db, detectors=model_registry.get_detectors()
+            )
+            results["labelize_model"] = _result(
+                len(model_sample), time.perf_counter() - started_at
+            )
+    finally:
+        db.close()
+    return results, article_ids
+
+
+def bench_reads(article_ids: list[str], repeat: int) -> dict:
+    """Time dedup lookups, aggregations and the read endpoints on the stored corpus"""
+    from fastapi.testclient import TestClient
+    from database import aggregation, crud, database
+    import main
+    import response_cache
+
+    results = {}
+    db = database.SessionLocal()
+    try:
+        # Half of the looked up ids are stored, half are not
+        lookup_ids = article_ids[: len(article_ids) // 2] + [
+            f"unknown-{index}" for index in range(len(article_ids) // 2)
+        ]
+        results["get_existing_article_ids"] = _median_result(
+            len(lookup_ids),
+            lambda: crud.get_existing_article_ids(db, lookup_ids),
+            repeat,
+        )
+        date_range = {
+            "from_date": "2023-01-01T00:00:00Z",
+            "to_date": "2023-12-31T23:59:59Z",
+        }
+        results["aggregate_per_sources"] = _median_result(
+            len(article_ids),
+            lambda: aggregation.aggregate_per_sources(db, **date_range),
+            repeat,
+        )
+    finally:
+        db.close()
+
+    client = TestClient(main.app)
+
+    def get(path: str, params: dict | None = None, cold: bool = True):
+        if cold:
+            response_cache.response_cache.clear()
+        response = client.get(path, params=params)
+        response.raise_for_status()
+        return response
+
+    results["endpoint_articles_page"] = _median_result(
+        100, lambda: get("/articles/", {"limit": 100}), repeat
+    )
+    distribution = "/articles/get-distribution-fake-real-per-source"
+    results["endpoint_distribution_cold"] = _median_result(
+        len(article_ids), lambda: get(distribution, date_range), repeat
+    )
+    get(distribution, date_range)
+    results["endpoint_distribution_cached"] = _median_result(
+        len(article_ids), lambda: get(distribution, date_range, cold=False), repeat
+    )
+    results["endpoint_export_ndjson"] = _median_result(
+        len(article_ids), lambda: get("/articles/export", {"format": "ndjson"}), 1
+    )
+    return results
+
+
+def bench_pre_process_crossover(
+    batch_sizes: list[int] = CROSSOVER_BATCH_SIZES,
+    seed: int = 0,
+    repeat: int = BENCH_REPEAT,
+) -> dict:
+    """Time the row and columnar pre-processing paths on batches of growing size
+
+    Returns:
+        dict: timings of both paths per batch size, and the smallest batch size
+        from which the columnar path is faster
+    """
+    from processing import pre_process
+
+    # Import pandas before timing, its first import takes longer than any batch
+    pre_process.select_and_prepare_articles_columnar("", [])
+    results = {}
+    crossover = None
+    for batch_size in batch_sizes:
+        keywords, response = next(
+            synthetic.generate_pages(batch_size, seed, batch_size)
+        )
+        articles = response["articles"]
+        rows = pre_process.select_and_prepare_articles_rows(keywords, articles)
+        columns = pre_process.select_and_prepare_articles_columnar(keywords, articles)
+        if rows != columns:
+            raise AssertionError(f"Columnar output differs for {batch_size} articles")
+        results[str(batch_size)] = {
+            "rows": _median_result(
+                batch_size,
+                lambda keywords=keywords, articles=articles: pre_process.select_and_prepare_articles_rows(
+                    keywords, articles
+                ),
+                repeat,
+            ),
+            "columnar": _median_result(
+                batch_size,
+                lambda keywords=keywords, articles=articles: pre_process.select_and_prepare_articles_columnar(
+                    keywords, articles
+                ),
+                repeat,
+            ),
+        }
+        timings = results[str(batch_size)]
+        if crossover is None and (
+            timings["columnar"]["seconds"] < timings["rows"]["seconds"]
+        ):
+            crossover = batch_size
+    return {"batch_sizes": results, "crossover_batch_size": crossover}
+
+
+@contextmanager
+def _fresh_database(directory: str):
+    # Sessions, sync jobs and the API reach the engine through the database module
+    from database import async_database, database, models
+
+    initial_engine = database.engine
+    initial_read_engine = database.read_engine
+    initial_async_engine = async_database.async_engine
+    engine = database.create_sqlite_aware_engine(f"sqlite:///{directory}/bench.db")
+    read_engine = database.create_sqlite_aware_engine(
+        f"sqlite:///{directory}/bench.db", read_only=True
+    )
+    async_engine = async_database.create_pooled_async_engine(
+        f"sqlite+aiosqlite:///{directory}/bench.db"
+    )
+    database.engine = engine
+    database.SessionLocal.configure(bind=engine)
+    database.read_engine = read_engine
+    database.ReadSessionLocal.configure(bind=read_engine)
+    async_database.async_engine = async_engine
+    async_database.AsyncSessionLocal.configure(bind=async_engine)
+    models.Base.metadata.create_all(bind=engine)
+    try:
+        yield engine
+    finally:
+        database.engine = initial_engine
+        database.SessionLocal.configure(bind=initial_engine)
+        database.read_engine = initial_read_engine
+        database.ReadSessionLocal.configure(bind=initial_read_engine)
+        async_database.async_engine = initial_async_engine
+        async_database.AsyncSessionLocal.configure(bind=initial_async_engine)
+        engine.dispose()
+        read_engine.dispose()
+        asyncio.run(async_engine.dispose())
+
+
+def run_benchmarks(
+    sizes: list[int],
+    seed: int = 0,
+    repeat: int = BENCH_REPEAT,
+    real_model: bool = False,
+) -> dict:
+    """Run every benchmark for each corpus size
+
+    Args:
+        sizes (list[int]): numbers of articles generated
+        seed (int, optional): seed of the synthetic corpus. Defaults to 0.
+        repeat (int, optional): runs of the read benchmarks, the median is kept
+        real_model (bool, optional): also labelize a sample with the configured detectors
+
+    Returns:
+        dict: environment of the run and results per size and benchmark
+    """
+    os.environ["PRELOAD_DETECTORS"] = "false"
+    results = {}
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as directory, _fresh_database(directory):
+            pipeline_results, article_ids = bench_pipeline(size, seed, real_model)
+            results[str(size)] = {
+                **pipeline_results,
+                **bench_reads(article_ids, repeat),
+            }
+    return {
+        "meta": {
+            "created_at": datetime.utcnow().isoformat(),
+            "seed": seed,
+            "repeat": repeat,
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+        },
+        "results": results,
+    }
+
+
+def compare_results(
+    baseline: dict, current: dict, threshold: float = REGRESSION_THRESHOLD
+) -> list[dict]:
+    """Compare the duration of every benchmark run in both results
+
+    Args:
+        baseline (dict): saved results of the reference run
+        current (dict): results of the run checked
+        threshold (float, optional): slowdown tolerated, 0.1 flags runs 10% slower
+
+    Returns:
+        list[dict]: durations, ratio and regression flag of each benchmark
+    """
+    comparisons = []
+    for size, benchmarks in current["results"].items():
+        for name, result in benchmarks.items():
+            reference = baseline["results"].get(size, {}).get(name)
+            if reference is None or not reference["seconds"]:
+                continue
+            ratio = result["seconds"] / reference["seconds"]
+            comparisons.append(
+                {
+                    "size": size,
+                    "benchmark": name,
+                    "baseline_seconds": reference["seconds"],
+                    "current_seconds": result["seconds"],
+                    "ratio": round(ratio, 3),
+                    "regression": ratio > 1 + threshold,
+                }
+            )
+    return comparisons
+
+
+def _print_comparisons(comparisons: list[dict]):
+    for comparison in comparisons:
+        flag = "REGRESSION" if comparison["regression"] else ""
+        print(
+            f"{comparison['size']:>8} {comparison['benchmark']:<32}"
+            f" {comparison['baseline_seconds']:>10.4f}s {comparison['current_seconds']:>10.4f}s"
+            f" x{comparison['ratio']:<6} {flag}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run")
+    run_parser.add_argument("--sizes", default="1000,10000")
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--repeat", type=int, default=BENCH_REPEAT)
+    run_parser.add_argument("--real-model", action="store_true")
+    run_parser.add_argument("--output", type=Path, default=Path("bench_results.json"))
+    crossover_parser = commands.add_parser("crossover")
+    crossover_parser.add_argument("--seed", type=int, default=0)
+    crossover_parser.add_argument("--repeat", type=int, default=BENCH_REPEAT)
+    compare_parser = commands.add_parser("compare")
+    compare_parser.add_argument("baseline", type=Path)
+    compare_parser.add_argument("current", type=Path)
+    compare_parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+    args = parser.parse_args()
+    if args.command == "run":
+        report = run_benchmarks(
+            [int(size) for size in args.sizes.split(",")],
+            args.seed,
+            args.repeat,
+            args.real_model,
+        )
+        args.output.write_text(json.dumps(report, indent=4))
+        print(json.dumps(report["results"], indent=4))
+    elif args.command == "crossover":
+        report = bench_pre_process_crossover(seed=args.seed, repeat=args.repeat)
+        for batch_size, timings in report["batch_sizes"].items():
+            print(
+                f"{batch_size:>8} rows {timings['rows']['seconds']:.5f}s"
+                f" columnar {timings['columnar']['seconds']:.5f}s"
+            )
+        print(
+            f"Columnar pre-processing is faster from {report['crossover_batch_size']} articles"
+        )
+    else:
+        comparisons = compare_results(
+            json.loads(args.baseline.read_text()),
+            json.loads(args.current.read_text()),
+            args.threshold,
+        )
+        _print_comparisons(comparisons)
+        # A non zero exit code lets CI fail on regressions
+        sys.exit(
+            1 if any(comparison["regression"] for comparison in comparisons) else 0
+        )
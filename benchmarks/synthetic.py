@@ -0,0 +1,119 @@
+"""Seeded generator of synthetic news api responses
+
+Write a corpus with `python -m benchmarks.synthetic --size 100000 --output corpus.json`,
+the same seed always gives the same articles.
+"""
+
+import argparse
+import json
+import random
+from datetime import datetime, timedelta
+from pathlib import Path
+
+ARTICLES_PER_PAGE = 100
+SOURCES = [
+    "Axios",
+    "BBC News",
+    "CBS News",
+    "CNBC",
+    "CNN",
+    "Fox News",
+    "MSNBC",
+    "TechCrunch",
+    "The Wall Street Journal",
+    "The Washington Post",
+    "Time",
+    "USA Today",
+]
+KEYWORDS = ["artificial intelligence", "deep learning", "chatGPT", "climate change"]
+WORDS = (
+    "model data climate market research government people study company report "
+    "energy policy technology language network training election health science "
+    "learning system world security city water industry growth record analysis "
+    "researchers announced warned expected could would said new first last year "
+    "week global national local public private open large small early recent"
+).split()
+# Share of articles dropped by pre-processing, as in the real api responses
+REMOVED_RATE = 0.03
+INCOMPLETE_RATE = 0.03
+# Share of articles repeated from an earlier page, as across overlapping queries
+DUPLICATE_RATE = 0.05
+START_DATE = datetime(2023, 1, 1)
+
+
+def _sentence(rng: random.Random, nb_words: int) -> str:
+    words = rng.choices(WORDS, k=nb_words)
+    return " ".join(words).capitalize() + "."
+
+
+def generate_article(rng: random.Random, index: int) -> dict:
+    """Generate one article in the format of the news api"""
+    source = rng.choice(SOURCES)
+    published_at = START_DATE + timedelta(seconds=rng.randrange(365 * 24 * 3600))
+    content = " ".join(_sentence(rng, rng.randint(8, 20)) for _ in range(3))[:200]
+    article = {
+        "source": {"id": source.lower().replace(" ", "-"), "name": source},
+        "author": f"{rng.choice(WORDS).capitalize()} {rng.choice(WORDS).capitalize()}",
+        "title": _sentence(rng, rng.randint(6, 14)),
+        "description": _sentence(rng, rng.randint(15, 40)),
+        "url": f"https://www.{source.lower().replace(' ', '')}.com/articles/{index}",
+        "urlToImage": None,
+        "publishedAt": published_at.strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "content": f"{content}… [+{rng.randint(500, 20000)} chars]",
+    }
+    draw = rng.random()
+    if draw < REMOVED_RATE:
+        article["source"]["name"] = "[Removed]"
+    elif draw < REMOVED_RATE + INCOMPLETE_RATE:
+        article["content"] = None
+    return article
+
+
+def generate_pages(size: int, seed: int = 0, page_size: int = ARTICLES_PER_PAGE):
+    """Yield news api responses holding `size` articles in total
+
+    Args:
+        size (int): number of articles generated
+        seed (int, optional): seed of the generator. Defaults to 0.
+        page_size (int, optional): articles per response. Defaults to 100.
+
+    Yields:
+        tuple[str, dict]: searched keywords and news api response of each page
+    """
+    rng = random.Random(seed)
+    previous_page = []
+    for start in range(0, size, page_size):
+        articles = []
+        for index in range(start, min(start + page_size, size)):
+            if previous_page and rng.random() < DUPLICATE_RATE:
+                articles.append(rng.choice(previous_page))
+            else:
+                articles.append(generate_article(rng, index))
+        previous_page = articles
+        yield rng.choice(KEYWORDS), {
+            "status": "ok",
+            "totalResults": size,
+            "articles": articles,
+        }
+
+
+def write_corpus(path: Path, size: int, seed: int = 0):
+    """Write every generated article in a single news api response file"""
+    with open(path, "w") as file:
+        file.write(f'{{"status": "ok", "totalResults": {size}, "articles": [')
+        separator = ""
+        for _, response in generate_pages(size, seed):
+            for article in response["articles"]:
+                file.write(separator + json.dumps(article))
+                separator = ", "
+        file.write("]}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, default=Path("synthetic_corpus.json"))
+    args = parser.parse_args()
+    write_corpus(args.output, args.size, args.seed)
+    print(f"Wrote {args.size} articles to {args.output}")
@@ -1,112 +1,188 @@
-from sqlalchemy import func, case
+from datetime import date
+from sqlalchemy import func
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from . import models, schemas
+import monitoring
+from . import models, rollup
+
+LABELS = ["fake", "real"]
+
+
+def _to_day(value: str) -> date:
+    # Dates are received in ISO 8601, rollups are kept per day
+    return date.fromisoformat(value[:10])
+
+
+def _average(score_sum: float | None, count: int | None) -> float | None:
+    return score_sum / count if count else None
+
+
+def _counters(row: dict, exclude_near_duplicates: bool) -> dict:
+    # Near-duplicates are counted twice in the rollups, apart in prefixed counters
+    if not exclude_near_duplicates:
+        return {column: row[column] for column in rollup.BASE_COUNTER_COLUMNS}
+    return {
+        column: row[column] - row[rollup.NEAR_DUPLICATE_PREFIX + column]
+        for column in rollup.BASE_COUNTER_COLUMNS
+    }
+
+
+# Query summing the daily rollups of the date range, grouped by the given columns
+def _sum_rollups(
+    db: Session,
+    group_by: list[str],
+    from_date: str,
+    to_date: str,
+    model_name: str | None = None,
+    source: str | None = None,
+    searched_keywords: str | None = None,
+    rollup_model=models.DailySourceRollup,
+):
+    query = db.query(
+        *[getattr(rollup_model, column) for column in group_by],
+        *[
+            func.sum(getattr(rollup_model, column)).label(column)
+            for column in rollup.COUNTER_COLUMNS
+        ],
+    ).filter(
+        rollup_model.day >= _to_day(from_date),
+        rollup_model.day <= _to_day(to_date),
+    )
+    if model_name is not None:
+        query = query.filter(rollup_model.model_name == model_name)
+    if source is not None:
+        query = query.filter(rollup_model.article_source == source)
+    if searched_keywords is not None:
+        query = query.filter(rollup_model.searched_keywords == searched_keywords)
+    with monitoring.timed(
+        monitoring.DB_QUERY_SECONDS, query=f"sum_{rollup_model.__tablename__}"
+    ):
+        return query.group_by(
+            *[getattr(rollup_model, column) for column in group_by]
+        ).all()
 
 
 # Query summing and averaging article metadata labels and confidence scores per source
-def aggregate_per_sources(db: Session, from_date: str, to_date: str):
-    result = (
-        db.query(
-            models.NewsArticle.article_source,
-            models.NewsArticle.searched_keywords,
-            func.sum(
-                case([(models.NewsArticle.title_detection_label == "Fake", 1)], else_=0)
-            ).label("sum_of_fake_titles"),
-            func.sum(
-                case([(models.NewsArticle.title_detection_label == "Real", 1)], else_=0)
-            ).label("sum_of_real_titles"),
-            func.sum(
-                case(
-                    [(models.NewsArticle.description_detection_label == "Fake", 1)],
-                    else_=0,
-                )
-            ).label("sum_of_fake_descriptions"),
-            func.sum(
-                case(
-                    [(models.NewsArticle.description_detection_label == "Real", 1)],
-                    else_=0,
-                )
-            ).label("sum_of_real_descriptions"),
-            func.sum(
-                case(
-                    [(models.NewsArticle.content_detection_label == "Fake", 1)], else_=0
-                )
-            ).label("sum_of_fake_contents"),
-            func.sum(
-                case(
-                    [(models.NewsArticle.content_detection_label == "Real", 1)], else_=0
-                )
-            ).label("sum_of_real_contents"),
-            func.avg(
-                case(
-                    [
-                        (
-                            models.NewsArticle.title_detection_label == "Fake",
-                            models.NewsArticle.title_detection_score,
-                        )
-                    ],
-                    else_=None,
-                )
-            ).label("average_score_for_fake_titles"),
-            func.avg(
-                case(
-                    [
-                        (
-                            models.NewsArticle.title_detection_label == "Real",
-                            models.NewsArticle.title_detection_score,
-                        )
-                    ],
-                    else_=None,
+def aggregate_per_sources(
+    db: Session,
+    from_date: str,
+    to_date: str,
+    model_name: str | None = None,
+    exclude_near_duplicates: bool = False,
+    source: str | None = None,
+    searched_keywords: str | None = None,
+):
+    group_by = ["article_source", "searched_keywords", "model_name"]
+    rows = {}
+    # Articles are counted under the keyword they were stored with, and those
+    # returned by several searches under the other keywords as well
+    for rollup_model in (models.DailySourceRollup, models.DailyKeywordRollup):
+        for row in _sum_rollups(
+            db,
+            group_by,
+            from_date,
+            to_date,
+            model_name,
+            source,
+            searched_keywords,
+            rollup_model,
+        ):
+            key = tuple(row._mapping[column] for column in group_by)
+            if key not in rows:
+                rows[key] = dict(row._mapping)
+                continue
+            for column in rollup.COUNTER_COLUMNS:
+                rows[key][column] += row._mapping[column]
+    result = []
+    for row in rows.values():
+        distribution = {
+            "article_source": row["article_source"],
+            "searched_keywords": row["searched_keywords"],
+            "model_name": row["model_name"],
+            "sum_of_near_duplicates": row["near_duplicate_article_count"],
+        }
+        row = _counters(row, exclude_near_duplicates)
+        for field in rollup.FIELDS:
+            for label in LABELS:
+                distribution[f"sum_of_{label}_{field}s"] = row[
+                    f"{label}_{field}s_count"
+                ]
+        for field in rollup.FIELDS:
+            for label in LABELS:
+                distribution[f"average_score_for_{label}_{field}s"] = _average(
+                    row[f"{label}_{field}s_score_sum"], row[f"{label}_{field}s_count"]
                 )
-            ).label("average_score_for_real_titles"),
-            func.avg(
-                case(
-                    [
-                        (
-                            models.NewsArticle.description_detection_label == "Fake",
-                            models.NewsArticle.description_detection_score,
-                        )
-                    ],
-                    else_=None,
-                )
-            ).label("average_score_for_fake_descriptions"),
-            func.avg(
-                case(
-                    [
-                        (
-                            models.NewsArticle.description_detection_label == "Real",
-                            models.NewsArticle.description_detection_score,
-                        )
-                    ],
-                    else_=None,
-                )
-            ).label("average_score_for_real_descriptions"),
-            func.avg(
-                case(
-                    [
-                        (
-                            models.NewsArticle.content_detection_label == "Fake",
-                            models.NewsArticle.content_detection_score,
-                        )
-                    ],
-                    else_=None,
-                )
-            ).label("average_score_for_fake_contents"),
-            func.avg(
-                case(
-                    [
-                        (
-                            models.NewsArticle.content_detection_label == "Real",
-                            models.NewsArticle.content_detection_score,
-                        )
-                    ],
-                    else_=None,
-                )
-            ).label("average_score_for_real_contents"),
-        )
-        .group_by(
-            models.NewsArticle.article_source, models.NewsArticle.searched_keywords
-        )
-        .all()
+        result.append(distribution)
+    return result
+
+
+# Query averaging the confidence score of each label per source
+def average_confidence_per_source(
+    db: Session,
+    from_date: str,
+    to_date: str,
+    model_name: str | None = None,
+    exclude_near_duplicates: bool = False,
+):
+    rows = _sum_rollups(
+        db, ["article_source", "model_name"], from_date, to_date, model_name
     )
+    result = []
+    for row in rows:
+        row = dict(row._mapping)
+        confidence = {
+            "article_source": row["article_source"],
+            "model_name": row["model_name"],
+            "near_duplicate_count": row["near_duplicate_article_count"],
+        }
+        row = _counters(row, exclude_near_duplicates)
+        confidence["article_count"] = row["article_count"]
+        for label in LABELS:
+            label_count = sum(row[f"{label}_{field}s_count"] for field in rollup.FIELDS)
+            confidence[f"average_score_for_{label}"] = _average(
+                sum(row[f"{label}_{field}s_score_sum"] for field in rollup.FIELDS),
+                label_count,
+            )
+            for field in rollup.FIELDS:
+                confidence[f"average_score_for_{label}_{field}s"] = _average(
+                    row[f"{label}_{field}s_score_sum"], row[f"{label}_{field}s_count"]
+                )
+        result.append(confidence)
     return result
+
+
+# Async equivalents, the queries above run on the connection of an AsyncSession
+async def aggregate_per_sources_async(
+    db: AsyncSession,
+    from_date: str,
+    to_date: str,
+    model_name: str | None = None,
+    exclude_near_duplicates: bool = False,
+    source: str | None = None,
+    searched_keywords: str | None = None,
+):
+    return await db.run_sync(
+        aggregate_per_sources,
+        from_date,
+        to_date,
+        model_name,
+        exclude_near_duplicates,
+        source,
+        searched_keywords,
+    )
+
+
+async def average_confidence_per_source_async(
+    db: AsyncSession,
+    from_date: str,
+    to_date: str,
+    model_name: str | None = None,
+    exclude_near_duplicates: bool = False,
+):
+    return await db.run_sync(
+        average_confidence_per_source,
+        from_date,
+        to_date,
+        model_name,
+        exclude_near_duplicates,
+    )
@@ -0,0 +1,47 @@
+import os
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from .database import SQLALCHEMY_READ_DATABASE_URL, configure_sqlite
+
+# Drivers of the async engine, aiosqlite locally and asyncpg for postgres
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
+DATABASE_POOL_SIZE = int(os.getenv("DATABASE_POOL_SIZE", "10"))
+# Connections opened above the pool size under load, closed once returned
+DATABASE_MAX_OVERFLOW = int(os.getenv("DATABASE_MAX_OVERFLOW", "20"))
+DATABASE_POOL_TIMEOUT = float(os.getenv("DATABASE_POOL_TIMEOUT", "30"))
+DATABASE_POOL_RECYCLE = int(os.getenv("DATABASE_POOL_RECYCLE", "1800"))
+
+
+def to_async_url(url: str) -> str:
+    """Return the url of the same database through its async driver"""
+    scheme, separator, rest = url.partition("://")
+    return ASYNC_DRIVERS.get(scheme, scheme) + separator + rest
+
+
+# The async engine serves the read endpoints
+ASYNC_DATABASE_URL = os.getenv(
+    "ASYNC_DATABASE_URL", to_async_url(SQLALCHEMY_READ_DATABASE_URL)
+)
+
+
+def create_pooled_async_engine(url: str = ASYNC_DATABASE_URL):
+    # Connections are kept open between requests, sqlite ones included
+    engine = create_async_engine(
+        url,
+        poolclass=AsyncAdaptedQueuePool,
+        pool_size=DATABASE_POOL_SIZE,
+        max_overflow=DATABASE_MAX_OVERFLOW,
+        pool_timeout=DATABASE_POOL_TIMEOUT,
+        pool_recycle=DATABASE_POOL_RECYCLE,
+        pool_pre_ping=True,
+    )
+    configure_sqlite(engine.sync_engine, read_only=True)
+    return engine
+
+
+async_engine = create_pooled_async_engine()
+# Objects stay readable after a commit, they are serialized once the session is done
+AsyncSessionLocal = sessionmaker(
+    async_engine, class_=AsyncSession, expire_on_commit=False
+)
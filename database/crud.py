@@ -1,5 +1,41 @@
+import base64
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from sqlalchemy import and_, or_, select
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from . import models, schemas
+import monitoring
+from . import data_version, models, rollup, schemas
+from .database import dialect_insert
+
+logger = logging.getLogger(__name__)
+
+# Number of values bound in a single IN clause
+IN_CLAUSE_CHUNK_SIZE = 500
+# Number of articles written per executemany by the bulk insert path
+BULK_INSERT_CHUNK_SIZE = int(os.getenv("BULK_INSERT_CHUNK_SIZE", "1000"))
+ARTICLE_COLUMNS = [
+    column.name
+    for column in models.NewsArticle.__table__.columns
+    if column.name != "id"
+]
+
+
+def _get_dialect(db: Session | Connection):
+    return db.dialect if isinstance(db, Connection) else db.get_bind().dialect
+
+
+def _insert_ignoring_conflicts(
+    db: Session | Connection, model, index_elements: list[str]
+):
+    table = getattr(model, "__table__", model)
+    return dialect_insert(db, table).on_conflict_do_nothing(
+        index_elements=index_elements
+    )
 
 
 # Create
@@ -12,12 +48,346 @@ def create_article(db: Session, article_data: schemas.NewsArticle):
 
 
 def batch_create_articles(db: Session, articles_data: list[schemas.NewsArticle]):
-    batched_articles = [models.NewsArticle(**article) for article in articles_data]
-    db.add_all(batched_articles)
-    db.commit()
-    for article in batched_articles:
-        db.refresh(article)
-    return batched_articles
+    rows, _ = bulk_insert_articles(db, articles_data)
+    return rows
+
+
+# Create (Bulk insert without ORM objects)
+def bulk_insert_articles(
+    db: Session | Connection,
+    articles_data: list[dict],
+    chunk_size: int = BULK_INSERT_CHUNK_SIZE,
+) -> tuple[list[tuple[int, str]], list[dict]]:
+    """Insert articles chunk by chunk with executemany, skipping the stored ones
+
+    With a Session every chunk is committed on its own. With a Connection (for
+    instance from `engine.begin()`) no ORM object nor identity map is involved
+    and the transaction is left to the caller, who counts and logs the stored
+    articles once it is committed.
+
+    Args:
+        db (Session | Connection): session or core connection to write with
+        articles_data (list[dict]): articles metadata, labelized
+        chunk_size (int, optional): articles per executemany. Defaults to BULK_INSERT_CHUNK_SIZE.
+
+    Returns:
+        tuple[list[tuple[int, str]], list[dict]]: (id, article_id) of the inserted
+        rows and the size, duration and throughput of each chunk
+    """
+    table = models.NewsArticle.__table__
+    statement = _insert_ignoring_conflicts(db, table, index_elements=["article_id"])
+    # executemany with RETURNING is only available on some drivers
+    use_returning = getattr(_get_dialect(db), "insert_executemany_returning", False)
+    if use_returning:
+        statement = statement.returning(table.c.id, table.c.article_id)
+    rows = []
+    chunk_reports = []
+    for start in range(0, len(articles_data), chunk_size):
+        started_at = time.perf_counter()
+        chunk = {
+            article["article_id"]: article
+            for article in articles_data[start : start + chunk_size]
+        }
+        existing_ids = get_existing_article_ids(db, list(chunk))
+        new_articles = [
+            article
+            for article_id, article in chunk.items()
+            if article_id not in existing_ids
+        ]
+        values = [
+            {column: article.get(column) for column in ARTICLE_COLUMNS}
+            for article in new_articles
+        ]
+        chunk_rows = []
+        if values:
+            with monitoring.timed(monitoring.DB_QUERY_SECONDS, query="insert_articles"):
+                # Articles stored in the meantime are skipped instead of failing the chunk
+                result = db.execute(statement, values)
+                _insert_detection_results(db, new_articles)
+                _insert_near_duplicate_index(db, new_articles)
+                _insert_article_keywords(
+                    db,
+                    [
+                        (article["article_id"], article["searched_keywords"])
+                        for article in new_articles
+                    ],
+                )
+                # Rollups are updated in the same transaction as the articles
+                rollup.apply_rollup_deltas(
+                    db, rollup.compute_rollup_deltas(new_articles)
+                )
+                # Cached responses of the read endpoints are stale after the commit
+                data_version.bump_data_version(db)
+                if use_returning:
+                    chunk_rows = [tuple(row) for row in result]
+                else:
+                    chunk_rows = _get_article_rows(
+                        db, [value["article_id"] for value in values]
+                    )
+        if isinstance(db, Session):
+            with monitoring.timed(
+                monitoring.DB_COMMIT_SECONDS, operation="bulk_insert_articles"
+            ):
+                db.commit()
+        elapsed = time.perf_counter() - started_at
+        chunk_reports.append(
+            {
+                "articles": len(chunk),
+                "inserted": len(chunk_rows),
+                "seconds": elapsed,
+                "articles_per_second": len(chunk) / elapsed if elapsed else 0.0,
+            }
+        )
+        # A transaction of the caller may still roll back and be applied again
+        if isinstance(db, Session):
+            log_stored_articles(chunk_reports[-1:])
+        rows += chunk_rows
+    return rows, chunk_reports
+
+
+def log_stored_articles(chunk_reports: list[dict]):
+    """Count and log the articles of committed chunks, see bulk_insert_articles"""
+    for report in chunk_reports:
+        monitoring.count_articles("stored", report["inserted"])
+        logger.info(
+            "Inserted %d/%d articles in %.3fs (%.0f articles/s)",
+            report["inserted"],
+            report["articles"],
+            report["seconds"],
+            report["articles_per_second"],
+        )
+
+
+def _insert_detection_results(db: Session | Connection, articles: list[dict]):
+    # One narrow row per (article, field, model), whatever the number of detectors
+    values = [
+        {
+            "article_id": article["article_id"],
+            "field": field,
+            "model_name": model_name,
+            "label": detection["label"],
+            "score": detection["score"],
+            "stage": detection.get("stage", "full"),
+        }
+        for article in articles
+        for model_name, fields in article.get("detections", {}).items()
+        for field, detection in fields.items()
+    ]
+    if values:
+        db.execute(
+            _insert_ignoring_conflicts(
+                db,
+                models.DetectionResult,
+                index_elements=["article_id", "field", "model_name"],
+            ),
+            values,
+        )
+
+
+def _insert_article_keywords(
+    db: Session | Connection, memberships: list[tuple[str, str]]
+):
+    if memberships:
+        db.execute(
+            _insert_ignoring_conflicts(
+                db, models.ArticleKeyword, ["article_id", "searched_keywords"]
+            ),
+            [
+                {"article_id": article_id, "searched_keywords": keywords}
+                for article_id, keywords in memberships
+            ],
+        )
+
+
+def _get_article_keywords(
+    db: Session | Connection, article_ids: list[str]
+) -> set[tuple[str, str]]:
+    memberships = set()
+    for start in range(0, len(article_ids), IN_CLAUSE_CHUNK_SIZE):
+        rows = db.execute(
+            select(
+                models.ArticleKeyword.article_id,
+                models.ArticleKeyword.searched_keywords,
+            ).where(
+                models.ArticleKeyword.article_id.in_(
+                    article_ids[start : start + IN_CLAUSE_CHUNK_SIZE]
+                )
+            )
+        )
+        memberships.update((article_id, keywords) for article_id, keywords in rows)
+    return memberships
+
+
+# Create (Record the keywords of stored articles, returns those of articles not stored yet)
+def insert_article_keywords(
+    db: Session | Connection, memberships: list[tuple[str, str]]
+) -> list[tuple[str, str]]:
+    memberships = sorted(set(memberships))
+    stored_ids = get_existing_article_ids(
+        db, sorted({article_id for article_id, _ in memberships})
+    )
+    recorded = _get_article_keywords(db, sorted(stored_ids))
+    new_memberships = [
+        membership
+        for membership in memberships
+        if membership[0] in stored_ids and membership not in recorded
+    ]
+    if new_memberships:
+        _insert_article_keywords(db, new_memberships)
+        # Counted under their other keywords with the results already stored
+        rollup.apply_rollup_deltas(
+            db,
+            rollup.compute_membership_deltas(db, new_memberships),
+            models.DailyKeywordRollup,
+        )
+        data_version.bump_data_version(db)
+    return [membership for membership in memberships if membership[0] not in stored_ids]
+
+
+def _insert_near_duplicate_index(db: Session | Connection, articles: list[dict]):
+    # Signatures and bands are computed by processing.near_duplicates while labelizing
+    indexed_articles = [
+        article for article in articles if article.get("minhash_signature")
+    ]
+    if not indexed_articles:
+        return
+    db.execute(
+        _insert_ignoring_conflicts(db, models.MinHashSignature, ["article_id"]),
+        [
+            {
+                "article_id": article["article_id"],
+                "signature": article["minhash_signature"],
+            }
+            for article in indexed_articles
+        ],
+    )
+    db.execute(
+        _insert_ignoring_conflicts(db, models.LshBand, ["band_key", "article_id"]),
+        [
+            {"band_key": band_key, "article_id": article["article_id"]}
+            for article in indexed_articles
+            for band_key in article["lsh_band_keys"]
+        ],
+    )
+    links = [
+        {
+            "article_id": article["article_id"],
+            "canonical_article_id": article["near_duplicate_of"],
+            "similarity": article["near_duplicate_similarity"],
+        }
+        for article in articles
+        if article.get("near_duplicate_of")
+    ]
+    if links:
+        db.execute(
+            _insert_ignoring_conflicts(db, models.NearDuplicateLink, ["article_id"]),
+            links,
+        )
+
+
+# Read (Get the articles sharing an lsh band with a batch, per band key)
+def get_lsh_candidates(
+    db: Session | Connection, band_keys: list[str]
+) -> dict[str, list[str]]:
+    candidates = {}
+    with monitoring.timed(monitoring.DB_QUERY_SECONDS, query="lsh_candidates"):
+        for start in range(0, len(band_keys), IN_CLAUSE_CHUNK_SIZE):
+            rows = db.execute(
+                select(models.LshBand.band_key, models.LshBand.article_id).where(
+                    models.LshBand.band_key.in_(
+                        band_keys[start : start + IN_CLAUSE_CHUNK_SIZE]
+                    )
+                )
+            )
+            for band_key, article_id in rows:
+                candidates.setdefault(band_key, []).append(article_id)
+    return candidates
+
+
+# Read (Get the minhash signatures of a batch of articles)
+def get_minhash_signatures(
+    db: Session | Connection, article_ids: list[str]
+) -> dict[str, bytes]:
+    signatures = {}
+    for start in range(0, len(article_ids), IN_CLAUSE_CHUNK_SIZE):
+        rows = db.execute(
+            select(
+                models.MinHashSignature.article_id, models.MinHashSignature.signature
+            ).where(
+                models.MinHashSignature.article_id.in_(
+                    article_ids[start : start + IN_CLAUSE_CHUNK_SIZE]
+                )
+            )
+        )
+        signatures.update((article_id, signature) for article_id, signature in rows)
+    return signatures
+
+
+# Read (Get the canonical article of the near-duplicates among a batch of articles)
+def get_near_duplicate_links(
+    db: Session | Connection, article_ids: list[str]
+) -> dict[str, str]:
+    links = {}
+    for start in range(0, len(article_ids), IN_CLAUSE_CHUNK_SIZE):
+        rows = db.execute(
+            select(
+                models.NearDuplicateLink.article_id,
+                models.NearDuplicateLink.canonical_article_id,
+            ).where(
+                models.NearDuplicateLink.article_id.in_(
+                    article_ids[start : start + IN_CLAUSE_CHUNK_SIZE]
+                )
+            )
+        )
+        links.update((article_id, canonical_id) for article_id, canonical_id in rows)
+    return links
+
+
+# Read (Get the detection results of a batch of articles, per model and field)
+def get_detection_results(
+    db: Session | Connection, article_ids: list[str]
+) -> dict[str, dict]:
+    detections = {}
+    for start in range(0, len(article_ids), IN_CLAUSE_CHUNK_SIZE):
+        rows = db.execute(
+            select(
+                models.DetectionResult.article_id,
+                models.DetectionResult.model_name,
+                models.DetectionResult.field,
+                models.DetectionResult.label,
+                models.DetectionResult.score,
+                models.DetectionResult.stage,
+            ).where(
+                models.DetectionResult.article_id.in_(
+                    article_ids[start : start + IN_CLAUSE_CHUNK_SIZE]
+                )
+            )
+        )
+        for article_id, model_name, field, label, score, stage in rows:
+            detections.setdefault(article_id, {}).setdefault(model_name, {})[field] = {
+                "label": label,
+                "score": score,
+                "stage": stage,
+            }
+    return detections
+
+
+def _get_article_rows(
+    db: Session | Connection, article_ids: list[str]
+) -> list[tuple[int, str]]:
+    rows = []
+    for start in range(0, len(article_ids), IN_CLAUSE_CHUNK_SIZE):
+        rows += [
+            tuple(row)
+            for row in db.execute(
+                select(models.NewsArticle.id, models.NewsArticle.article_id).where(
+                    models.NewsArticle.article_id.in_(
+                        article_ids[start : start + IN_CLAUSE_CHUNK_SIZE]
+                    )
+                )
+            )
+        ]
+    return rows
 
 
 # Read (Get by ID)
@@ -29,6 +399,24 @@ def get_article_by_id(db: Session, article_id: str):
     )
 
 
+# Read (Get the ids already stored among a batch of article ids)
+def get_existing_article_ids(
+    db: Session | Connection, article_ids: list[str]
+) -> set[str]:
+    existing_ids = set()
+    with monitoring.timed(monitoring.DB_QUERY_SECONDS, query="existing_article_ids"):
+        for start in range(0, len(article_ids), IN_CLAUSE_CHUNK_SIZE):
+            rows = db.execute(
+                select(models.NewsArticle.article_id).where(
+                    models.NewsArticle.article_id.in_(
+                        article_ids[start : start + IN_CLAUSE_CHUNK_SIZE]
+                    )
+                )
+            )
+            existing_ids.update(article_id for (article_id,) in rows)
+    return existing_ids
+
+
 # Read (Get by Source)
 def get_article_by_source(db: Session, article_source: str):
     return (
@@ -66,6 +454,213 @@ def get_all_articles(db: Session, skip: int = 0, limit: int = 10):
     return db.query(models.NewsArticle).offset(skip).limit(limit).all()
 
 
+def encode_cursor(article_publication_date: datetime, id: int) -> str:
+    cursor = json.dumps([article_publication_date.isoformat(), id])
+    return base64.urlsafe_b64encode(cursor.encode("UTF-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    """Return the publication date and id of the last article of the previous page
+
+    Raises:
+        ValueError: the cursor was not produced by encode_cursor
+    """
+    try:
+        article_publication_date, id = json.loads(base64.urlsafe_b64decode(cursor))
+        if not isinstance(id, int) or isinstance(id, bool):
+            raise ValueError(f"Invalid article id in cursor: {id!r}")
+        return datetime.fromisoformat(article_publication_date), id
+    except TypeError as error:
+        # Decoding and unpacking errors are already ValueError
+        raise ValueError(f"Invalid cursor: {cursor!r}") from error
+
+
+def to_datetime(value: str) -> datetime:
+    # Dates are received in ISO 8601, with or without the trailing Z
+    return datetime.fromisoformat(value.removesuffix("Z"))
+
+
+def _filter_articles(
+    query,
+    source: str | None = None,
+    from_date: str | None = None,
+    to_date: str | None = None,
+):
+    if source is not None:
+        query = query.where(models.NewsArticle.article_source == source)
+    if from_date is not None:
+        query = query.where(
+            models.NewsArticle.article_publication_date >= to_datetime(from_date)
+        )
+    if to_date is not None:
+        query = query.where(
+            models.NewsArticle.article_publication_date <= to_datetime(to_date)
+        )
+    return query
+
+
+# Read (Get a page of articles, newest first, after the cursor of the previous page)
+def get_articles_page(
+    db: Session,
+    source: str | None = None,
+    from_date: str | None = None,
+    to_date: str | None = None,
+    cursor: str | None = None,
+    limit: int = 100,
+) -> tuple[list[models.NewsArticle], str | None]:
+    query = _filter_articles(select(models.NewsArticle), source, from_date, to_date)
+    if cursor is not None:
+        cursor_date, cursor_id = decode_cursor(cursor)
+        query = query.where(
+            or_(
+                models.NewsArticle.article_publication_date < cursor_date,
+                and_(
+                    models.NewsArticle.article_publication_date == cursor_date,
+                    models.NewsArticle.id < cursor_id,
+                ),
+            )
+        )
+    with monitoring.timed(monitoring.DB_QUERY_SECONDS, query="articles_page"):
+        articles = (
+            db.execute(
+                query.order_by(
+                    models.NewsArticle.article_publication_date.desc(),
+                    models.NewsArticle.id.desc(),
+                ).limit(limit + 1)
+            )
+            .scalars()
+            .all()
+        )
+    # The extra article only tells if a next page exists
+    if len(articles) <= limit:
+        return articles, None
+    last_article = articles[limit - 1]
+    return articles[:limit], encode_cursor(
+        last_article.article_publication_date, last_article.id
+    )
+
+
+# Read (Stream articles rows without building ORM objects)
+def stream_articles(
+    db: Session,
+    source: str | None = None,
+    from_date: str | None = None,
+    to_date: str | None = None,
+    chunk_size: int = 1000,
+):
+    query = _filter_articles(
+        select(models.NewsArticle.__table__), source, from_date, to_date
+    ).order_by(
+        models.NewsArticle.article_publication_date.desc(),
+        models.NewsArticle.id.desc(),
+    )
+    result = db.execute(query.execution_options(stream_results=True))
+    for rows in result.mappings().partitions(chunk_size):
+        yield from rows
+
+
+# Read (Get cached inference results by text hash)
+def get_cached_inferences(
+    db: Session, model_name: str, model_revision: str, text_hashes: list[str]
+) -> dict[str, tuple[str, float]]:
+    cached_inferences = {}
+    for start in range(0, len(text_hashes), IN_CLAUSE_CHUNK_SIZE):
+        rows = db.query(
+            models.InferenceResult.text_hash,
+            models.InferenceResult.label,
+            models.InferenceResult.score,
+        ).filter(
+            models.InferenceResult.model_name == model_name,
+            models.InferenceResult.model_revision == model_revision,
+            models.InferenceResult.text_hash.in_(
+                text_hashes[start : start + IN_CLAUSE_CHUNK_SIZE]
+            ),
+        )
+        for text_hash, label, score in rows:
+            cached_inferences[text_hash] = (label, score)
+    return cached_inferences
+
+
+# Create (Store inference results, already cached texts are ignored)
+def batch_create_cached_inferences(
+    db: Session | Connection,
+    model_name: str,
+    model_revision: str,
+    inferences: dict[str, tuple[str, float]],
+):
+    if not inferences:
+        return
+    statement = _insert_ignoring_conflicts(
+        db,
+        models.InferenceResult,
+        index_elements=["model_name", "model_revision", "text_hash"],
+    )
+    db.execute(
+        statement,
+        [
+            {
+                "model_name": model_name,
+                "model_revision": model_revision,
+                "text_hash": text_hash,
+                "label": label,
+                "score": score,
+                "created_at": datetime.utcnow(),
+            }
+            for text_hash, (label, score) in inferences.items()
+        ],
+    )
+    if isinstance(db, Session):
+        db.commit()
+
+
+# Read (Get the newest publication date synced per keyword, for a set of sources)
+def get_sync_watermarks(
+    db: Session | Connection, keywords: list[str], sources: str
+) -> dict[str, datetime]:
+    rows = db.execute(
+        select(
+            models.SyncWatermark.searched_keywords,
+            models.SyncWatermark.newest_publication_date,
+        ).where(
+            models.SyncWatermark.sources == sources,
+            models.SyncWatermark.searched_keywords.in_(keywords),
+        )
+    )
+    return {
+        searched_keywords: newest_publication_date
+        for searched_keywords, newest_publication_date in rows
+    }
+
+
+# Create or update (Move the watermarks of a set of sources forward)
+def save_sync_watermarks(
+    db: Session | Connection, watermarks: dict[str, datetime], sources: str
+):
+    if not watermarks:
+        return
+    table = models.SyncWatermark.__table__
+    statement = dialect_insert(db, table)
+    statement = statement.on_conflict_do_update(
+        index_elements=["searched_keywords", "sources"],
+        set_={
+            "newest_publication_date": statement.excluded.newest_publication_date,
+            "updated_at": statement.excluded.updated_at,
+        },
+    )
+    db.execute(
+        statement,
+        [
+            {
+                "searched_keywords": searched_keywords,
+                "sources": sources,
+                "newest_publication_date": newest_publication_date,
+                "updated_at": datetime.utcnow(),
+            }
+            for searched_keywords, newest_publication_date in watermarks.items()
+        ],
+    )
+
+
 # Update
 def update_article(db: Session, article_id: str, article_data: schemas.NewsArticle):
     article = (
@@ -93,3 +688,24 @@ def delete_article(db: Session, article_id: str):
         db.commit()
         return True
     return False
+
+
+# Async equivalents, the queries above run on the connection of an AsyncSession
+# without blocking the event loop while the database answers
+async def get_articles_page_async(
+    db: AsyncSession,
+    source: str | None = None,
+    from_date: str | None = None,
+    to_date: str | None = None,
+    cursor: str | None = None,
+    limit: int = 100,
+) -> tuple[list[models.NewsArticle], str | None]:
+    return await db.run_sync(
+        get_articles_page, source, from_date, to_date, cursor, limit
+    )
+
+
+async def get_existing_article_ids_async(
+    db: AsyncSession, article_ids: list[str]
+) -> set[str]:
+    return await db.run_sync(get_existing_article_ids, article_ids)
@@ -0,0 +1,41 @@
+import uuid
+from sqlalchemy import insert, select, update
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from . import models
+
+# The version lives in the database so that every worker and every process
+# writing articles (sync, backfill, rollup rebuild) invalidates cached responses
+_ROW_ID = 1
+_SELECT_VERSION = select(
+    models.DataVersion.generation, models.DataVersion.version
+).where(models.DataVersion.id == _ROW_ID)
+
+
+def _format(row) -> str:
+    # The generation is drawn with the row, a recreated database never reuses an etag
+    return f"{row.generation}:{row.version}" if row is not None else "empty"
+
+
+def get_data_version(db: Session | Connection) -> str:
+    return _format(db.execute(_SELECT_VERSION).first())
+
+
+async def get_data_version_async(db: AsyncSession) -> str:
+    return _format((await db.execute(_SELECT_VERSION)).first())
+
+
+def bump_data_version(db: Session | Connection):
+    """Increment the version in the transaction of the caller, it changes with the commit"""
+    result = db.execute(
+        update(models.DataVersion)
+        .where(models.DataVersion.id == _ROW_ID)
+        .values(version=models.DataVersion.version + 1)
+    )
+    if not result.rowcount:
+        db.execute(
+            insert(models.DataVersion).values(
+                id=_ROW_ID, generation=uuid.uuid4().hex, version=1
+            )
+        )
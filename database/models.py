@@ -1,5 +1,17 @@
+from datetime import datetime
 from .database import Base
-from sqlalchemy import Column, Integer, String, Float, UniqueConstraint, DateTime
+from sqlalchemy import (
+    Column,
+    Integer,
+    String,
+    Float,
+    UniqueConstraint,
+    DateTime,
+    Date,
+    Index,
+    ForeignKey,
+    LargeBinary,
+)
 
 
 class NewsArticle(Base):
@@ -21,4 +33,225 @@ class NewsArticle(Base):
     content_detection_label = Column(String, nullable=True)
     content_detection_score = Column(Float, nullable=True)
 
-    __table_args__ = (UniqueConstraint("article_id", name="unique_article_id"),)
+    __table_args__ = (
+        UniqueConstraint("article_id", name="unique_article_id"),
+        # Keyset pagination walks (publication date, id) from the newest article
+        Index("ix_news_articles_publication_date_id", "article_publication_date", "id"),
+        Index(
+            "ix_news_articles_source_publication_date_id",
+            "article_source",
+            "article_publication_date",
+            "id",
+        ),
+        Index(
+            "ix_news_articles_keywords_publication_date_id",
+            "searched_keywords",
+            "article_publication_date",
+            "id",
+        ),
+    )
+
+
+class InferenceResult(Base):
+    __tablename__ = "inference_cache"
+
+    id = Column(Integer, primary_key=True, index=True)
+    model_name = Column(String, nullable=False)
+    model_revision = Column(String, nullable=False)
+    # sha256 of the normalized text fed to the model
+    text_hash = Column(String, nullable=False)
+    label = Column(String, nullable=False)
+    score = Column(Float, nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint(
+            "model_name", "model_revision", "text_hash", name="unique_inference_key"
+        ),
+    )
+
+
+class ArticleKeyword(Base):
+    """Keywords whose search returned an article, the first one is kept on the article"""
+
+    __tablename__ = "article_keywords"
+
+    id = Column(Integer, primary_key=True, index=True)
+    article_id = Column(String, ForeignKey("news_articles.article_id"), nullable=False)
+    searched_keywords = Column(String, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint(
+            "article_id", "searched_keywords", name="unique_article_keyword"
+        ),
+        Index(
+            "ix_article_keywords_keywords_article_id", "searched_keywords", "article_id"
+        ),
+    )
+
+
+class RollupCounters:
+    """Labels counts and scores sums of the articles of a day, source, keyword and model"""
+
+    id = Column(Integer, primary_key=True, index=True)
+    day = Column(Date, nullable=False)
+    article_source = Column(String, nullable=False)
+    searched_keywords = Column(String, nullable=False)
+    model_name = Column(String, nullable=False)
+    article_count = Column(Integer, nullable=False, default=0)
+    fake_titles_count = Column(Integer, nullable=False, default=0)
+    fake_titles_score_sum = Column(Float, nullable=False, default=0.0)
+    real_titles_count = Column(Integer, nullable=False, default=0)
+    real_titles_score_sum = Column(Float, nullable=False, default=0.0)
+    fake_descriptions_count = Column(Integer, nullable=False, default=0)
+    fake_descriptions_score_sum = Column(Float, nullable=False, default=0.0)
+    real_descriptions_count = Column(Integer, nullable=False, default=0)
+    real_descriptions_score_sum = Column(Float, nullable=False, default=0.0)
+    fake_contents_count = Column(Integer, nullable=False, default=0)
+    fake_contents_score_sum = Column(Float, nullable=False, default=0.0)
+    real_contents_count = Column(Integer, nullable=False, default=0)
+    real_contents_score_sum = Column(Float, nullable=False, default=0.0)
+    # Share of the counters above coming from near-duplicates of another article
+    near_duplicate_article_count = Column(Integer, nullable=False, default=0)
+    near_duplicate_fake_titles_count = Column(Integer, nullable=False, default=0)
+    near_duplicate_fake_titles_score_sum = Column(Float, nullable=False, default=0.0)
+    near_duplicate_real_titles_count = Column(Integer, nullable=False, default=0)
+    near_duplicate_real_titles_score_sum = Column(Float, nullable=False, default=0.0)
+    near_duplicate_fake_descriptions_count = Column(Integer, nullable=False, default=0)
+    near_duplicate_fake_descriptions_score_sum = Column(
+        Float, nullable=False, default=0.0
+    )
+    near_duplicate_real_descriptions_count = Column(Integer, nullable=False, default=0)
+    near_duplicate_real_descriptions_score_sum = Column(
+        Float, nullable=False, default=0.0
+    )
+    near_duplicate_fake_contents_count = Column(Integer, nullable=False, default=0)
+    near_duplicate_fake_contents_score_sum = Column(Float, nullable=False, default=0.0)
+    near_duplicate_real_contents_count = Column(Integer, nullable=False, default=0)
+    near_duplicate_real_contents_score_sum = Column(Float, nullable=False, default=0.0)
+
+
+class DailySourceRollup(RollupCounters, Base):
+    """Counters of the articles under the keyword they were stored with"""
+
+    __tablename__ = "daily_source_rollups"
+
+    __table_args__ = (
+        UniqueConstraint(
+            "day",
+            "article_source",
+            "searched_keywords",
+            "model_name",
+            name="unique_rollup_key",
+        ),
+    )
+
+
+class DailyKeywordRollup(RollupCounters, Base):
+    """Counters of the articles under the other keywords whose search returned them
+
+    Kept apart so that totals per source count every article once.
+    """
+
+    __tablename__ = "daily_keyword_rollups"
+
+    __table_args__ = (
+        UniqueConstraint(
+            "day",
+            "article_source",
+            "searched_keywords",
+            "model_name",
+            name="unique_keyword_rollup_key",
+        ),
+    )
+
+
+class DetectionResult(Base):
+    """Label and score given by a detector to a field of an article"""
+
+    __tablename__ = "detection_results"
+
+    id = Column(Integer, primary_key=True, index=True)
+    article_id = Column(String, ForeignKey("news_articles.article_id"), nullable=False)
+    field = Column(String, nullable=False)
+    model_name = Column(String, nullable=False)
+    label = Column(String, nullable=False)
+    score = Column(Float, nullable=False)
+    # Cascade stage which produced the result, first_pass or full, near_duplicate
+    # when it was copied from the canonical article
+    stage = Column(String, nullable=False, default="full")
+
+    __table_args__ = (
+        UniqueConstraint(
+            "article_id", "field", "model_name", name="unique_detection_result"
+        ),
+        Index("ix_detection_results_model_field_label", "model_name", "field", "label"),
+    )
+
+
+class MinHashSignature(Base):
+    """MinHash signature of the shingled title, description and content of an article"""
+
+    __tablename__ = "minhash_signatures"
+
+    id = Column(Integer, primary_key=True, index=True)
+    article_id = Column(
+        String, ForeignKey("news_articles.article_id"), unique=True, nullable=False
+    )
+    signature = Column(LargeBinary, nullable=False)
+
+
+class LshBand(Base):
+    """Hash of one band of a signature, articles sharing a band are candidate duplicates"""
+
+    __tablename__ = "lsh_bands"
+
+    id = Column(Integer, primary_key=True, index=True)
+    band_key = Column(String, nullable=False)
+    article_id = Column(String, ForeignKey("news_articles.article_id"), nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("band_key", "article_id", name="unique_lsh_band"),
+    )
+
+
+class NearDuplicateLink(Base):
+    """Article whose detection results were copied from a near-duplicate canonical article"""
+
+    __tablename__ = "near_duplicate_links"
+
+    id = Column(Integer, primary_key=True, index=True)
+    article_id = Column(
+        String, ForeignKey("news_articles.article_id"), unique=True, nullable=False
+    )
+    canonical_article_id = Column(
+        String, ForeignKey("news_articles.article_id"), nullable=False, index=True
+    )
+    # Estimated Jaccard similarity of the shingles of both articles
+    similarity = Column(Float, nullable=False)
+
+
+class SyncWatermark(Base):
+    """Publication date of the newest article synced for a keyword and a set of sources"""
+
+    __tablename__ = "sync_watermarks"
+
+    id = Column(Integer, primary_key=True, index=True)
+    searched_keywords = Column(String, nullable=False)
+    sources = Column(String, nullable=False)
+    newest_publication_date = Column(DateTime, nullable=False)
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint("searched_keywords", "sources", name="unique_sync_watermark"),
+    )
+
+
+class DataVersion(Base):
+    """Single row versioning the stored data, bumped by each transaction changing it"""
+
+    __tablename__ = "data_version"
+
+    id = Column(Integer, primary_key=True)
+    generation = Column(String, nullable=False)
+    version = Column(Integer, nullable=False, default=0)
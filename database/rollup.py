@@ -0,0 +1,226 @@
+"""Incremental maintenance of the daily_source_rollups and daily_keyword_rollups tables
+
+Rebuild the tables from the stored articles with `python -m database.rollup rebuild`.
+"""
+
+import argparse
+from sqlalchemy import delete, select
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+from . import crud, data_version, models
+from processing.model_registry import DETECTOR_MODELS, label_group
+from .database import dialect_insert
+
+FIELDS = ["title", "description", "content"]
+KEY_COLUMNS = ["day", "article_source", "searched_keywords", "model_name"]
+BASE_COUNTER_COLUMNS = ["article_count"] + [
+    f"{label}_{field}s_{measure}"
+    for field in FIELDS
+    for label in ("fake", "real")
+    for measure in ("count", "score_sum")
+]
+# Near-duplicates are counted twice, in the base counters and apart
+NEAR_DUPLICATE_PREFIX = "near_duplicate_"
+COUNTER_COLUMNS = BASE_COUNTER_COLUMNS + [
+    NEAR_DUPLICATE_PREFIX + column for column in BASE_COUNTER_COLUMNS
+]
+# Columns of the stored articles the counters are computed from
+STORED_ARTICLE_COLUMNS = [
+    "article_id",
+    "article_source",
+    "article_publication_date",
+    "searched_keywords",
+] + [
+    f"{field}_detection_{measure}" for field in FIELDS for measure in ("label", "score")
+]
+
+
+def compute_rollup_deltas(
+    articles: list[dict], default_model_name: str | None = None
+) -> dict[tuple, dict]:
+    """Sum the labels and scores of a batch of articles per rollup key
+
+    Args:
+        articles (list[dict]): labelized articles metadata, with the results of
+            each model in `detections`, and `near_duplicate_of` for near-duplicates
+        default_model_name (str, optional): model of the articles without results
+
+    Returns:
+        dict[tuple, dict]: counters to add, keyed by (day, source, keyword, model)
+    """
+    deltas = {}
+    for article in articles:
+        # Articles stored before detection_results hold the results of one model
+        detections = article.get("detections") or {
+            article.get("detection_model")
+            or default_model_name: {
+                field: {
+                    "label": article.get(f"{field}_detection_label"),
+                    "score": article.get(f"{field}_detection_score"),
+                }
+                for field in FIELDS
+            }
+        }
+        for model_name, fields in detections.items():
+            key = (
+                article["article_publication_date"].date(),
+                article["article_source"],
+                article["searched_keywords"],
+                model_name,
+            )
+            delta = deltas.setdefault(key, dict.fromkeys(COUNTER_COLUMNS, 0))
+            prefixes = [""]
+            if article.get("near_duplicate_of"):
+                prefixes.append(NEAR_DUPLICATE_PREFIX)
+            for prefix in prefixes:
+                delta[f"{prefix}article_count"] += 1
+                for field, detection in fields.items():
+                    group = label_group(detection["label"])
+                    if group is None:
+                        continue
+                    delta[f"{prefix}{group}_{field}s_count"] += 1
+                    delta[f"{prefix}{group}_{field}s_score_sum"] += (
+                        detection["score"] or 0.0
+                    )
+    return deltas
+
+
+def _add_deltas(total: dict[tuple, dict], deltas: dict[tuple, dict]):
+    for key, delta in deltas.items():
+        counters = total.setdefault(key, dict.fromkeys(COUNTER_COLUMNS, 0))
+        for column, value in delta.items():
+            counters[column] += value
+
+
+def _attach_stored_results(db: Session | Connection, articles: list[dict]):
+    article_ids = [article["article_id"] for article in articles]
+    detections = crud.get_detection_results(db, article_ids)
+    canonical_ids = crud.get_near_duplicate_links(db, article_ids)
+    for article in articles:
+        article["detections"] = detections.get(article["article_id"])
+        article["near_duplicate_of"] = canonical_ids.get(article["article_id"])
+
+
+def compute_membership_deltas(
+    db: Session | Connection,
+    memberships: list[tuple[str, str]],
+    default_model_name: str | None = None,
+) -> dict[tuple, dict]:
+    """Sum the stored results of articles under the other keywords which returned them
+
+    Args:
+        db (Session | Connection): session or core connection to read with
+        memberships (list[tuple[str, str]]): (article id, keywords) of stored articles
+        default_model_name (str, optional): model of the articles without results.
+            Defaults to the first detector, whose results the article columns hold.
+
+    Returns:
+        dict[tuple, dict]: counters to add to daily_keyword_rollups
+    """
+    table = models.NewsArticle.__table__
+    article_ids = sorted({article_id for article_id, _ in memberships})
+    articles = {}
+    for start in range(0, len(article_ids), crud.IN_CLAUSE_CHUNK_SIZE):
+        rows = db.execute(
+            select(*[table.c[column] for column in STORED_ARTICLE_COLUMNS]).where(
+                table.c.article_id.in_(
+                    article_ids[start : start + crud.IN_CLAUSE_CHUNK_SIZE]
+                )
+            )
+        )
+        articles.update((row.article_id, dict(row._mapping)) for row in rows)
+    _attach_stored_results(db, list(articles.values()))
+    # The keyword an article was stored with is counted in daily_source_rollups
+    return compute_rollup_deltas(
+        [
+            {**articles[article_id], "searched_keywords": keywords}
+            for article_id, keywords in memberships
+            if article_id in articles
+            and keywords != articles[article_id]["searched_keywords"]
+        ],
+        default_model_name or DETECTOR_MODELS[0],
+    )
+
+
+def apply_rollup_deltas(
+    db: Session | Connection,
+    deltas: dict[tuple, dict],
+    rollup_model=models.DailySourceRollup,
+):
+    """Add counters to the rollup rows, in the transaction of the caller"""
+    if not deltas:
+        return
+    table = rollup_model.__table__
+    statement = dialect_insert(db, table)
+    statement = statement.on_conflict_do_update(
+        index_elements=KEY_COLUMNS,
+        set_={
+            column: table.c[column] + statement.excluded[column]
+            for column in COUNTER_COLUMNS
+        },
+    )
+    db.execute(
+        statement,
+        [{**dict(zip(KEY_COLUMNS, key)), **delta} for key, delta in deltas.items()],
+    )
+
+
+def rebuild_rollups(db: Session, model_name: str, chunk_size: int = 1000) -> int:
+    """Recompute every rollup row from the stored articles
+
+    Args:
+        db (Session): session to the database
+        model_name (str): model which labelized the articles without detection results
+        chunk_size (int, optional): articles read per round trip. Defaults to 1000.
+
+    Returns:
+        int: number of rollup rows written
+    """
+    articles = db.execute(
+        select(
+            *[
+                models.NewsArticle.__table__.c[column]
+                for column in STORED_ARTICLE_COLUMNS
+            ]
+        ).execution_options(stream_results=True)
+    )
+    deltas = {}
+    for rows in articles.partitions(chunk_size):
+        chunk = [dict(zip(STORED_ARTICLE_COLUMNS, row)) for row in rows]
+        _attach_stored_results(db, chunk)
+        _add_deltas(deltas, compute_rollup_deltas(chunk, model_name))
+    memberships = db.execute(
+        select(
+            models.ArticleKeyword.article_id, models.ArticleKeyword.searched_keywords
+        ).execution_options(stream_results=True)
+    )
+    keyword_deltas = {}
+    for rows in memberships.partitions(chunk_size):
+        _add_deltas(
+            keyword_deltas,
+            compute_membership_deltas(db, [tuple(row) for row in rows], model_name),
+        )
+    db.execute(delete(models.DailySourceRollup))
+    apply_rollup_deltas(db, deltas)
+    db.execute(delete(models.DailyKeywordRollup))
+    apply_rollup_deltas(db, keyword_deltas, models.DailyKeywordRollup)
+    data_version.bump_data_version(db)
+    db.commit()
+    return len(deltas) + len(keyword_deltas)
+
+
+if __name__ == "__main__":
+    from processing import model_registry
+    from .database import SessionLocal, engine
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("command", choices=["rebuild"])
+    parser.add_argument("--model-name", default=model_registry.DETECTOR_MODELS[0])
+    args = parser.parse_args()
+    models.Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        nb_rows = rebuild_rollups(db, args.model_name)
+    finally:
+        db.close()
+    print(f"Rebuilt {nb_rows} rollup rows")
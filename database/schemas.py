@@ -1,5 +1,9 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, validator
 from datetime import datetime
+import os
+
+# Texts of a single /detect request, larger requests could never fit the queue
+DETECT_MAX_TEXTS = int(os.getenv("DETECT_MAX_TEXTS", "256"))
 
 
 class NewsArticle(BaseModel):
@@ -20,3 +24,25 @@ class NewsArticle(BaseModel):
 
     class Config:
         orm_mode = True
+
+
+class DetectRequest(BaseModel):
+    text: str | list[str]
+
+    @validator("text")
+    def has_texts(cls, text):
+        if isinstance(text, list) and not text:
+            raise ValueError("at least one text is required")
+        if isinstance(text, list) and len(text) > DETECT_MAX_TEXTS:
+            raise ValueError(f"at most {DETECT_MAX_TEXTS} texts are accepted")
+        return text
+
+
+class Detection(BaseModel):
+    label: str
+    score: float
+
+
+class DetectResponse(BaseModel):
+    model_name: str
+    detections: list[Detection]
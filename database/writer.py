@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import os
+import queue
+import threading
+from concurrent.futures import Future
+import monitoring
+from . import database
+
+logger = logging.getLogger(__name__)
+
+# Writes queued by then are applied in the transaction of the first one
+WRITER_MAX_BATCH_SIZE = int(os.getenv("DATABASE_WRITER_MAX_BATCH_SIZE", "16"))
+
+_STOP = object()
+
+
+class DatabaseWriter:
+    """Single thread applying every ingest write, the writes queued together share a transaction
+
+    SQLite lets one connection write at a time, funnelling the writes through one
+    thread avoids "database is locked" errors and pays one commit per batch.
+    """
+
+    def __init__(self, max_batch_size: int = WRITER_MAX_BATCH_SIZE):
+        self.max_batch_size = max_batch_size
+        self.stats = {"writes": 0, "transactions": 0, "failures": 0}
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(
+            target=self._run, name="database-writer", daemon=True
+        )
+        self._thread.start()
+
+    def submit(self, write, *args) -> Future:
+        """Queue `write(connection, *args)`, its future holds the result once committed
+
+        A write runs again on its own when another write of its batch fails, it
+        must only act on the connection, side effects belong after the commit.
+        """
+        future = Future()
+        self._queue.put((write, args, future))
+        return future
+
+    async def run(self, write, *args):
+        """Queue a write and wait for its commit without blocking the event loop"""
+        return await asyncio.wrap_future(self.submit(write, *args))
+
+    def close(self):
+        """Apply the queued writes and stop the thread"""
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def _next_batch(self) -> list:
+        batch = [self._queue.get()]
+        # Only the writes already waiting are batched, a lone write is not delayed
+        while len(batch) < self.max_batch_size and batch[-1] is not _STOP:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            stop = batch[-1] is _STOP
+            writes = [
+                item
+                for item in batch
+                if item is not _STOP and item[2].set_running_or_notify_cancel()
+            ]
+            if writes:
+                self._apply(writes)
+            if stop:
+                return
+
+    def _apply(self, writes: list):
+        try:
+            with monitoring.timed(monitoring.DB_COMMIT_SECONDS, operation="writer"):
+                with database.engine.begin() as connection:
+                    results = [write(connection, *args) for write, args, _ in writes]
+        except Exception as error:
+            if len(writes) > 1:
+                # One failing write must not fail the others, they are applied alone
+                for write in writes:
+                    self._apply([write])
+                return
+            self.stats["failures"] += 1
+            logger.exception("Database write failed")
+            writes[0][2].set_exception(error)
+            return
+        self.stats["writes"] += len(writes)
+        self.stats["transactions"] += 1
+        for (_, _, future), result in zip(writes, results):
+            future.set_result(result)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer() -> DatabaseWriter:
+    """Return the writer shared by the whole process, started on first use"""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = DatabaseWriter()
+        return _writer
+
+
+def close_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is not None:
+            _writer.close()
+            _writer = None
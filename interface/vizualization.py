@@ -1,62 +1,148 @@
+import os
+import threading
+from datetime import date, timedelta
 import gradio as gr
 import pandas as pd
-import matplotlib
-
-matplotlib.use("agg")
-from matplotlib import pyplot as plt
 import requests
 
+API_URL = os.getenv("DASHBOARD_API_URL", "http://127.0.0.1:8000")
+# Seconds between two conditional requests of an open dashboard
+REFRESH_SECONDS = float(os.getenv("DASHBOARD_REFRESH_SECONDS", "10"))
+REQUEST_TIMEOUT = float(os.getenv("DASHBOARD_REQUEST_TIMEOUT", "5"))
+METADATA_ELEMENTS = ["Titles", "Descriptions", "Contents"]
+LABELS = ["Fake", "Real"]
 
-def read_distrubtion_per_source():
-    url = "http://127.0.0.1:8000/articles/get-distribution-fake-real-per-source"
-    response = requests.get(url)
-    return response.json()
 
+class DistributionClient:
+    """Read the distribution from the API, sending back the ETag of the last response
 
-def plot_distribution(df, metadata_element):
-    fig = plt.figure(figsize=(10, 6))
-    select_fake_data = f"sum_of_fake_{metadata_element.lower()}"
-    select_real_data = f"sum_of_real_{metadata_element.lower()}"
-    plt.bar(
-        df["article_source"],
-        df[select_fake_data],
-        label=f"Fake {metadata_element}",
-        alpha=0.7,
-    )
-    plt.bar(
-        df["article_source"],
-        df[select_real_data],
-        bottom=df[select_fake_data],
-        label=f"Real {metadata_element}",
-        alpha=0.7,
+    Responses are kept per filters, a 304 of the API means the kept one is still valid.
+    """
+
+    def __init__(self, api_url: str = API_URL, timeout: float = REQUEST_TIMEOUT):
+        self.url = f"{api_url}/articles/get-distribution-fake-real-per-source"
+        self.timeout = timeout
+        self._session = requests.Session()
+        self._responses = {}
+        self._lock = threading.Lock()
+
+    def fetch(self, filters: dict) -> tuple[str, list[dict]]:
+        """Return the ETag and the rows of the distribution for the filters
+
+        Raises:
+            requests.RequestException: the API could not be reached
+        """
+        params = {key: value for key, value in filters.items() if value}
+        key = tuple(sorted(params.items()))
+        with self._lock:
+            cached = self._responses.get(key)
+        headers = {"If-None-Match": cached[0]} if cached else {}
+        response = self._session.get(
+            self.url, params=params, headers=headers, timeout=self.timeout
+        )
+        if response.status_code == 304 and cached:
+            return cached
+        response.raise_for_status()
+        fetched = (response.headers.get("ETag", ""), response.json())
+        with self._lock:
+            self._responses[key] = fetched
+        return fetched
+
+
+client = DistributionClient()
+
+
+def to_plot_frame(rows: list[dict], metadata_element: str) -> pd.DataFrame:
+    """Sum the labels of a metadata element per source, one row per source and label"""
+    columns = ["article_source", "label", "count"]
+    if not rows:
+        return pd.DataFrame(columns=columns)
+    data = pd.DataFrame(rows)
+    frames = [
+        pd.DataFrame(
+            {
+                "article_source": data["article_source"],
+                "label": label,
+                "count": data[f"sum_of_{label.lower()}_{metadata_element.lower()}"],
+            }
+        )
+        for label in LABELS
+    ]
+    return (
+        pd.concat(frames)
+        .groupby(["article_source", "label"], as_index=False)["count"]
+        .sum()[columns]
     )
-    plt.xlabel("Article Source")
-    plt.ylabel(f"Number of {metadata_element}")
-    plt.title("Distribution of Fake and Real Titles per Article Source")
-    plt.xticks(rotation=45, ha="right")
-    plt.legend()
-    plt.tight_layout()
 
-    return fig
 
+def refresh(from_date, to_date, source, keywords, model_name, metadata_element, drawn):
+    """Redraw the plot when the data, the filters or the metadata element changed
 
-def make_plot(metadata_to_display):
-    return plot_distribution(data, metadata_to_display)
+    Returns:
+        tuple: update of the plot, update of the status and the drawn state
+    """
+    filters = {
+        "from_date": from_date.strip(),
+        "to_date": to_date.strip(),
+        "source": source.strip(),
+        "searched_keywords": keywords.strip(),
+        "model_name": model_name.strip(),
+    }
+    try:
+        etag, rows = client.fetch(filters)
+    except (requests.RequestException, ValueError) as error:
+        return gr.update(), f"API unavailable: {error}", drawn
+    if not isinstance(rows, list):
+        return gr.update(), f"Bad request: {rows}", drawn
+    state = (etag, tuple(sorted(filters.items())), metadata_element)
+    if state == drawn:
+        return gr.update(), gr.update(), drawn
+    plot = gr.update(
+        value=to_plot_frame(rows, metadata_element),
+        y_title=f"Number of {metadata_element}",
+    )
+    return plot, f"{len(rows)} source and keyword pairs", state
 
 
 def launch_web_interface():
+    today = date.today()
     with gr.Blocks() as dashboard:
+        with gr.Row():
+            from_date = gr.Textbox(
+                label="From date", value=(today - timedelta(days=30)).isoformat()
+            )
+            to_date = gr.Textbox(label="To date", value=today.isoformat())
+            source = gr.Textbox(label="Source", placeholder="All sources")
+            keywords = gr.Textbox(label="Keywords", placeholder="All keywords")
+            model_name = gr.Textbox(label="Model", placeholder="All models")
         button = gr.Radio(
             label="Metadata Element",
-            choices=["Titles", "Descriptions", "Contents"],
+            choices=METADATA_ELEMENTS,
             value="Titles",
         )
-        plot = gr.Plot(label="Plot")
-        button.change(make_plot, inputs=[button], outputs=[plot])
+        # Bars are drawn by the browser, the server only sends the summed counts
+        plot = gr.BarPlot(
+            x="article_source",
+            y="count",
+            color="label",
+            title="Distribution of Fake and Real per Article Source",
+            x_title="Article Source",
+            y_title="Number of Titles",
+            label="Plot",
+        )
+        status = gr.Markdown()
+        drawn = gr.State(None)
+        inputs = [from_date, to_date, source, keywords, model_name, button, drawn]
+        outputs = [plot, status, drawn]
+        for component in [from_date, to_date, source, keywords, model_name]:
+            component.submit(refresh, inputs=inputs, outputs=outputs)
+        button.change(refresh, inputs=inputs, outputs=outputs)
+        # The page is served right away, data is requested once it is open
+        dashboard.load(refresh, inputs=inputs, outputs=outputs)
+        timer = gr.Timer(REFRESH_SECONDS)
+        timer.tick(refresh, inputs=inputs, outputs=outputs)
     dashboard.launch()
 
 
 if __name__ == "__main__":
-    request_data = read_distrubtion_per_source()
-    data = pd.DataFrame(request_data)
     launch_web_interface()
@@ -1,10 +1,26 @@
-from fastapi import FastAPI, Depends, HTTPException
-from sqlalchemy.orm import Session
-from database import crud, database, models, schemas, aggregation
-from news_api import request_articles
-from processing import labelize, pre_process
-from math import ceil
-from datetime import datetime, timedelta
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import crud, data_version, database, models, schemas, aggregation
+from database import async_database, writer
+from news_api import async_client, full_text
+from processing import (
+    cascade,
+    dynamic_batching,
+    inference_cache,
+    model_registry,
+    sync_jobs,
+)
+import monitoring
+import response_cache
+from datetime import date, datetime, timedelta
+from typing import Literal
+import asyncio
+import csv
+import io
+import json
+import os
 
 MAX_NUMBER_OF_PAGES_TO_FETCH = 50
 TOPIC_SEARCHED = [
@@ -14,106 +30,343 @@ TOPIC_SEARCHED = [
     "climate change",
 ]
 SOURCES_LANGUAGE = "en"
+PRELOAD_DETECTORS = os.getenv("PRELOAD_DETECTORS", "true").lower() == "true"
 models.Base.metadata.create_all(bind=database.engine)
+database.add_missing_columns(models.Base.metadata)
+database.create_missing_indexes(models.Base.metadata)
 
 app = FastAPI()
 
 
+@app.on_event("startup")
+async def load_detectors():
+    # Models load in a background thread so the API answers right away
+    if PRELOAD_DETECTORS:
+        model_registry.load_detectors_in_background()
+
+
+@app.on_event("shutdown")
+async def close_http_clients():
+    await async_client.close_client()
+    await full_text.close_fetcher()
+    await dynamic_batching.batcher.close()
+    await async_database.async_engine.dispose()
+    # Queued writes are committed before the process exits
+    await asyncio.to_thread(writer.close_writer)
+
+
 @app.get("/")
 async def root():
     return {"message": "Hello World"}
 
 
-def get_db():
-    db = database.SessionLocal()
+@app.get("/ready")
+async def readiness():
+    status = model_registry.registry_status()
+    return JSONResponse(content=status, status_code=200 if status["ready"] else 503)
+
+
+@app.get("/inference-cache/stats")
+async def get_inference_cache_stats():
+    return inference_cache.inference_cache.stats()
+
+
+@app.get("/metrics")
+async def get_metrics():
+    if not monitoring.is_enabled():
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    content, media_type = monitoring.render_metrics()
+    # The content type already carries the charset of the exposition format
+    return Response(content=content, headers={"Content-Type": media_type})
+
+
+@app.get("/cascade/stats")
+async def get_cascade_stats():
+    return cascade.cascade_stats.to_dict()
+
+
+@app.post("/detect", response_model=schemas.DetectResponse)
+async def detect(request: schemas.DetectRequest):
+    # Texts of concurrent requests are scored together by the dynamic batcher
+    texts = [request.text] if isinstance(request.text, str) else request.text
     try:
+        detections = await dynamic_batching.batcher.detect(texts)
+    except dynamic_batching.TooManyTextsError as error:
+        raise HTTPException(status_code=422, detail=str(error))
+    except dynamic_batching.QueueFullError as error:
+        raise HTTPException(
+            status_code=429, detail=str(error), headers={"Retry-After": "1"}
+        )
+    except dynamic_batching.BatcherUnavailableError as error:
+        raise HTTPException(status_code=503, detail=str(error))
+    return {
+        "model_name": dynamic_batching.batcher.model_name,
+        "detections": detections,
+    }
+
+
+@app.get("/detect/stats")
+async def get_detect_stats():
+    return dynamic_batching.batcher.stats()
+
+
+async def get_db():
+    # Queries await the database instead of blocking the event loop
+    async with async_database.AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 
 @app.get(path="/sync-articles")
-async def sync_articles_from_query(db: Session = Depends(get_db)):
-    enriched_articles = []
-    for keywords in TOPIC_SEARCHED:
-        initial_response = request_articles.fetch_news_articles_based_on_query(
-            query=keywords, language=SOURCES_LANGUAGE, page=1
-        )
-        pages_per_request = 100
-        if initial_response["status"] == "error":
-            return {
-                "status": initial_response["status"],
-                "msg": initial_response["message"],
-            }
-        print(f"Request status : {initial_response['status']}")
-        _, nbrArticles, articles = initial_response.values()
-        nb_pages_to_query = ceil(nbrArticles / pages_per_request)
-        print(f"{nb_pages_to_query} pages to query")
-        print(f"{nbrArticles} expected...")
-        print(f"{len(articles)} articles are going to be processed...")
-        for p in range(2, nb_pages_to_query + 1):
-            response = request_articles.fetch_news_articles_based_on_query(
-                query=keywords, language=SOURCES_LANGUAGE, page=p
-            )
-            if response["status"] == "ok":
-                articles += response["articles"]
-            print(f"Added {len(response['articles'])} articles to be processed")
-        # selection and cleaning of articles metadata
-        pre_processed_articles = pre_process.select_and_prepare_articles(
-            keywords, articles
-        )
-        # Verify if articles already exists in db
-        batched_articles = []
-        for article in pre_processed_articles:
-            if crud.get_article_by_id(db, article["article_id"]) is None:
-                batched_articles.append(article)
-        # Labelize metadata from articles into fake / real
-        print(f"\nNum of articles sent for labelization is {len(batched_articles)}\n")
-        enriched_articles += labelize.labelize_articles(batched_articles)
-    print(f"\nNum of synced articles is {len(enriched_articles)}\n")
-    return crud.batch_create_articles(db, enriched_articles)
+async def sync_articles_from_query():
+    # The sync runs in the background, its progress is read from /sync-jobs/{job_id}
+    job = sync_jobs.start_sync_job(
+        TOPIC_SEARCHED, SOURCES_LANGUAGE, MAX_NUMBER_OF_PAGES_TO_FETCH
+    )
+    return job.to_dict()
+
+
+@app.get(path="/sync-jobs")
+async def get_sync_jobs():
+    return [job.to_dict() for job in sync_jobs.list_jobs()]
+
+
+@app.get(path="/sync-jobs/{job_id}")
+async def get_sync_job(job_id: str):
+    job = sync_jobs.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Sync job not found")
+    return job.to_dict()
+
+
+@app.delete(path="/sync-jobs/{job_id}")
+async def cancel_sync_job(job_id: str):
+    job = sync_jobs.cancel_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Sync job not found")
+    return job.to_dict()
+
+
+async def cached_json_response(
+    request: Request, db: AsyncSession, params: dict, compute
+) -> Response:
+    """Serve a read endpoint from the response cache, or 304 if the client is up to date
+
+    Args:
+        request (Request): incoming request, its path and If-None-Match header are used
+        db (AsyncSession): session the data version is read with, in the same
+            transaction as the data
+        params (dict): normalized query parameters the response depends on
+        compute (Callable): coroutine function returning the content and the
+            headers of the response
+
+    Returns:
+        Response: json response carrying an ETag of the data version
+    """
+    version = await data_version.get_data_version_async(db)
+    key = response_cache.make_key(request.url.path, params)
+    etag = response_cache.make_etag(key, version)
+    if request.headers.get("If-None-Match") == etag:
+        response_cache.response_cache.record_not_modified()
+        return Response(status_code=304, headers={"ETag": etag})
+    cached = response_cache.response_cache.get(key, version)
+    if cached is None:
+        content, headers = await compute()
+        body = json.dumps(jsonable_encoder(content)).encode("UTF-8")
+        response_cache.response_cache.put(key, version, body, headers)
+    else:
+        body, headers = cached
+    return Response(
+        content=body,
+        media_type="application/json",
+        headers={**headers, "ETag": etag},
+    )
 
 
 @app.get(path="/articles/", response_model=list[schemas.NewsArticle])
 async def get_available_articles(
-    db: Session = Depends(get_db),
-    source: str = "techcrunch",
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+    source: str | None = None,
     from_date: str | None = None,
     to_date: str | None = None,
-    limit: int = 100,
+    cursor: str | None = None,
+    limit: int = Query(100, ge=1, le=1000),
 ):
-    if from_date is not None and to_date is not None:
-        print(f"Getting data between {from_date} and {to_date}")
-        return crud.get_article_within_date_range(
-            db, from_date=from_date, to_date=to_date, limit=limit
-        )
-    elif from_date is None and to_date is None:
-        return crud.get_all_articles(db, limit=limit)
-    else:
-        # TODO : How should I handle errors with fastapi ? raise ?
-        return {"status": 403, "msg": "Bad request"}
+    async def read_articles():
+        # Pages are read with keyset pagination, the next page cursor is sent as header
+        try:
+            articles, next_cursor = await crud.get_articles_page_async(
+                db,
+                source=source,
+                from_date=from_date,
+                to_date=to_date,
+                cursor=cursor,
+                limit=limit,
+            )
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Bad request")
+        headers = {"X-Next-Cursor": next_cursor} if next_cursor is not None else {}
+        return [schemas.NewsArticle.from_orm(article) for article in articles], headers
+
+    params = {
+        "source": source,
+        "from_date": from_date,
+        "to_date": to_date,
+        "cursor": cursor,
+        "limit": limit,
+    }
+    return await cached_json_response(request, db, params, read_articles)
+
+
+def format_ndjson(rows):
+    for row in rows:
+        yield json.dumps(dict(row), default=datetime.isoformat) + "\n"
+
+
+def format_csv(rows):
+    buffer = io.StringIO()
+    csv_writer = csv.DictWriter(
+        buffer, fieldnames=crud.ARTICLE_COLUMNS, extrasaction="ignore"
+    )
+    csv_writer.writeheader()
+    for row in rows:
+        csv_writer.writerow(row)
+        if buffer.tell() > 64 * 1024:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+@app.get(path="/articles/export")
+async def export_articles(
+    format: Literal["ndjson", "csv"] = "ndjson",
+    source: str | None = None,
+    from_date: str | None = None,
+    to_date: str | None = None,
+):
+    # Once streaming started the status can no longer change to 400
+    try:
+        for value in (from_date, to_date):
+            if value is not None:
+                crud.to_datetime(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Bad request")
+
+    def stream_rows():
+        # The session lives as long as the response is streamed
+        db = database.ReadSessionLocal()
+        try:
+            rows = crud.stream_articles(
+                db, source=source, from_date=from_date, to_date=to_date
+            )
+            if format == "csv":
+                yield from format_csv(rows)
+            else:
+                yield from format_ndjson(rows)
+        finally:
+            db.close()
+
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(stream_rows(), media_type=media_type)
+
+
+def get_month_to_date_range() -> tuple[str, str]:
+    date_today = datetime.today().strftime("%Y-%m-%dT%H:%M:%SZ")
+    month_to_date = (datetime.today() - timedelta(days=30)).strftime(
+        "%Y-%m-%dT%H:%M:%SZ"
+    )
+    return month_to_date, date_today
+
+
+def validate_days(*values: str):
+    # Aggregations read the day of the dates, a malformed one is a bad request
+    for value in values:
+        try:
+            date.fromisoformat(value[:10])
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Bad request")
 
 
 @app.get(path="/articles/get-distribution-fake-real-per-source")
 async def get_distribution_fake_real_per_source(
-    db: Session = Depends(get_db),
+    request: Request,
+    db: AsyncSession = Depends(get_db),
     from_date: str | None = None,
     to_date: str | None = None,
+    model_name: str | None = None,
+    exclude_near_duplicates: bool = False,
+    source: str | None = None,
+    searched_keywords: str | None = None,
 ):
-    if from_date is not None and to_date is not None:
-        return aggregation.aggregate_per_sources(
-            db, from_date=from_date, to_date=to_date
-        )
-    elif from_date is None and to_date is None:
-        date_today = datetime.today().strftime("%Y-%m-%dT%H:%M:%SZ")
-        month_to_date = (datetime.today() - timedelta(days=30)).strftime(
-            "%Y-%m-%dT%H:%M:%SZ"
-        )
-        return aggregation.aggregate_per_sources(
-            db, from_date=month_to_date, to_date=date_today
+    if from_date is None and to_date is None:
+        from_date, to_date = get_month_to_date_range()
+    elif from_date is None or to_date is None:
+        return {"status": 403, "msg": "Bad request"}
+    validate_days(from_date, to_date)
+    # Aggregations are per day, the time of the range does not change the response
+    params = {
+        "from_date": from_date[:10],
+        "to_date": to_date[:10],
+        "model_name": model_name,
+        "exclude_near_duplicates": exclude_near_duplicates,
+        "source": source,
+        "searched_keywords": searched_keywords,
+    }
+
+    async def read_aggregation():
+        return (
+            await aggregation.aggregate_per_sources_async(
+                db,
+                from_date=from_date,
+                to_date=to_date,
+                model_name=model_name,
+                exclude_near_duplicates=exclude_near_duplicates,
+                source=source,
+                searched_keywords=searched_keywords,
+            ),
+            {},
         )
-    else:
+
+    return await cached_json_response(request, db, params, read_aggregation)
+
+
+@app.get(path="/articles/get-average-confidence-per-source")
+async def get_average_confidence_per_source(
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+    from_date: str | None = None,
+    to_date: str | None = None,
+    model_name: str | None = None,
+    exclude_near_duplicates: bool = False,
+):
+    if from_date is None and to_date is None:
+        from_date, to_date = get_month_to_date_range()
+    elif from_date is None or to_date is None:
         return {"status": 403, "msg": "Bad request"}
+    validate_days(from_date, to_date)
+    params = {
+        "from_date": from_date[:10],
+        "to_date": to_date[:10],
+        "model_name": model_name,
+        "exclude_near_duplicates": exclude_near_duplicates,
+    }
+
+    async def read_aggregation():
+        return (
+            await aggregation.average_confidence_per_source_async(
+                db,
+                from_date=from_date,
+                to_date=to_date,
+                model_name=model_name,
+                exclude_near_duplicates=exclude_near_duplicates,
+            ),
+            {},
+        )
+
+    return await cached_json_response(request, db, params, read_aggregation)
 
 
-# TODO : Endpoint for calculating average confidence per label per source
+@app.get("/response-cache/stats")
+async def get_response_cache_stats():
+    return response_cache.response_cache.stats()
@@ -0,0 +1,138 @@
+import os
+import time
+from contextlib import contextmanager, nullcontext
+
+# Metrics need prometheus_client, spans need opentelemetry, both are optional
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "false").lower() == "true"
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "false").lower() == "true"
+
+try:
+    import prometheus_client
+except ImportError:
+    prometheus_client = None
+
+try:
+    from opentelemetry import trace
+except ImportError:
+    trace = None
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+TOKENS_PER_SECOND_BUCKETS = (100, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000)
+
+
+class _NoopMetric:
+    """Stands for every metric when they are disabled, each call does nothing"""
+
+    def labels(self, *args, **kwargs):
+        return self
+
+    def observe(self, value: float):
+        pass
+
+    def inc(self, amount: float = 1):
+        pass
+
+
+_NOOP_METRIC = _NoopMetric()
+
+
+def is_enabled() -> bool:
+    return METRICS_ENABLED and prometheus_client is not None
+
+
+def _histogram(name: str, documentation: str, labels: list[str], buckets):
+    if not is_enabled():
+        return _NOOP_METRIC
+    return prometheus_client.Histogram(name, documentation, labels, buckets=buckets)
+
+
+def _counter(name: str, documentation: str, labels: list[str]):
+    if not is_enabled():
+        return _NOOP_METRIC
+    return prometheus_client.Counter(name, documentation, labels)
+
+
+FETCH_SECONDS = _histogram(
+    "news_fetch_seconds",
+    "Duration of the requests to the news api and to article pages",
+    ["endpoint"],
+    LATENCY_BUCKETS,
+)
+INFERENCE_BATCH_SECONDS = _histogram(
+    "inference_batch_seconds",
+    "Duration of the forward pass of a micro-batch",
+    ["model"],
+    LATENCY_BUCKETS,
+)
+INFERENCE_BATCH_SIZE = _histogram(
+    "inference_batch_size",
+    "Number of texts per micro-batch",
+    ["model"],
+    BATCH_SIZE_BUCKETS,
+)
+INFERENCE_TOKENS_PER_SECOND = _histogram(
+    "inference_tokens_per_second",
+    "Tokens processed per second by a micro-batch",
+    ["model"],
+    TOKENS_PER_SECOND_BUCKETS,
+)
+INFERENCE_TOKENS = _counter(
+    "inference_tokens", "Tokens sent to the detectors", ["model"]
+)
+DB_QUERY_SECONDS = _histogram(
+    "db_query_seconds", "Duration of the database queries", ["query"], LATENCY_BUCKETS
+)
+DB_COMMIT_SECONDS = _histogram(
+    "db_commit_seconds",
+    "Duration of the transactions writing articles",
+    ["operation"],
+    LATENCY_BUCKETS,
+)
+# Stages: fetched, filtered, deduplicated, labelized, near_duplicates, stored
+ARTICLES = _counter("articles", "Articles going through each sync stage", ["stage"])
+
+
+@contextmanager
+def _timed(histogram, labels: dict):
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.labels(**labels).observe(time.perf_counter() - started_at)
+
+
+def timed(histogram, **labels):
+    """Observe the duration of the block in the histogram, nothing when metrics are disabled"""
+    if histogram is _NOOP_METRIC:
+        return nullcontext()
+    return _timed(histogram, labels)
+
+
+def count_articles(stage: str, amount: int):
+    if amount:
+        ARTICLES.labels(stage=stage).inc(amount)
+
+
+def observe_inference_batch(model: str, batch_size: int, tokens: int, seconds: float):
+    INFERENCE_BATCH_SECONDS.labels(model=model).observe(seconds)
+    INFERENCE_BATCH_SIZE.labels(model=model).observe(batch_size)
+    INFERENCE_TOKENS.labels(model=model).inc(tokens)
+    if seconds:
+        INFERENCE_TOKENS_PER_SECOND.labels(model=model).observe(tokens / seconds)
+
+
+def span(name: str, **attributes):
+    """Open a tracing span around the block when tracing is enabled and installed
+
+    Spans opened in a coroutine are the parents of those opened by the tasks it
+    creates, so every stage of a sync job is traced under the span of the job.
+    """
+    if not TRACING_ENABLED or trace is None:
+        return nullcontext()
+    return trace.get_tracer(__name__).start_as_current_span(name, attributes=attributes)
+
+
+def render_metrics() -> tuple[bytes, str]:
+    """Return the metrics in the prometheus text format and its content type"""
+    return prometheus_client.generate_latest(), prometheus_client.CONTENT_TYPE_LATEST
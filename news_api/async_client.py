@@ -0,0 +1,217 @@
+import asyncio
+import os
+import random
+import time
+from datetime import datetime
+from math import ceil
+import httpx
+import monitoring
+from .request_articles import NEWS_API_BASE_URL, build_query_params
+
+NEWS_API_MAX_CONCURRENCY = int(os.getenv("NEWS_API_MAX_CONCURRENCY", "4"))
+# Requests per second allowed by the rate limiter
+NEWS_API_RATE_LIMIT = float(os.getenv("NEWS_API_RATE_LIMIT", "5"))
+NEWS_API_MAX_RETRIES = int(os.getenv("NEWS_API_MAX_RETRIES", "3"))
+NEWS_API_TIMEOUT = float(os.getenv("NEWS_API_TIMEOUT", "10"))
+# Seconds waited at most when the news api asks to retry later
+NEWS_API_MAX_RETRY_AFTER = float(os.getenv("NEWS_API_MAX_RETRY_AFTER", "60"))
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+ARTICLES_PER_PAGE = 100
+
+
+class TokenBucket:
+    """Rate limiter letting `rate` requests per second through, with bursts up to `capacity`"""
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1.0)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._updated_at) * self.rate
+                )
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class AsyncNewsApiClient:
+    """News api client sharing one keep-alive connection pool between concurrent requests"""
+
+    def __init__(
+        self,
+        base_url: str = NEWS_API_BASE_URL,
+        api_key: str | None = None,
+        max_concurrency: int = NEWS_API_MAX_CONCURRENCY,
+        rate_limit: float = NEWS_API_RATE_LIMIT,
+        max_retries: int = NEWS_API_MAX_RETRIES,
+        timeout: float = NEWS_API_TIMEOUT,
+    ):
+        self.api_key = api_key or os.getenv("NEWS_API_KEY")
+        self.max_retries = max_retries
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._rate_limiter = TokenBucket(rate_limit)
+        self._client = httpx.AsyncClient(
+            base_url=base_url,
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=max_concurrency,
+                max_keepalive_connections=max_concurrency,
+            ),
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        await self._client.aclose()
+
+    def _backoff_delay(self, attempt: int, response: httpx.Response | None) -> float:
+        retry_after = response.headers.get("Retry-After") if response else None
+        if retry_after is not None and retry_after.isdigit():
+            return min(float(retry_after), NEWS_API_MAX_RETRY_AFTER)
+        return 2**attempt * 0.5 + random.uniform(0, 0.5)
+
+    async def _get(self, path: str, params: dict) -> dict:
+        params = {**params, "apiKey": self.api_key}
+        for attempt in range(self.max_retries + 1):
+            response = None
+            async with self._semaphore:
+                await self._rate_limiter.acquire()
+                try:
+                    with monitoring.timed(monitoring.FETCH_SECONDS, endpoint=path):
+                        response = await self._client.get(path, params=params)
+                except httpx.TransportError as error:
+                    if attempt == self.max_retries:
+                        return {"status": "error", "message": repr(error)}
+            if response is not None:
+                if response.status_code not in RETRY_STATUS_CODES:
+                    try:
+                        return response.json()
+                    except ValueError:
+                        return {
+                            "status": "error",
+                            "message": f"News api answered {response.status_code} without json",
+                        }
+                if attempt == self.max_retries:
+                    return {
+                        "status": "error",
+                        "message": f"News api answered {response.status_code}",
+                    }
+            await asyncio.sleep(self._backoff_delay(attempt, response))
+
+    async def fetch_page(
+        self,
+        query: str = None,
+        language: str = None,
+        category: str = None,
+        page: int = 1,
+        from_date: datetime = None,
+        sort_by: str = None,
+    ) -> dict:
+        return await self._get(
+            "/everything",
+            build_query_params(language, query, category, page, from_date, sort_by),
+        )
+
+    async def iter_pages(self, query: str, language: str = None, max_pages: int = 1):
+        """Fetch the first page of a query, then the following pages concurrently
+
+        Args:
+            query (str): keywords searched
+            language (str, optional): language of the articles
+            max_pages (int, optional): upper number of pages fetched. Defaults to 1.
+
+        Yields:
+            dict: news api response of each page, as soon as it arrives
+        """
+        initial_response = await self.fetch_page(query=query, language=language)
+        yield initial_response
+        if initial_response["status"] == "error":
+            return
+        nb_pages_to_query = min(
+            ceil(initial_response["totalResults"] / ARTICLES_PER_PAGE), max_pages
+        )
+        pending = [
+            asyncio.ensure_future(
+                self.fetch_page(query=query, language=language, page=page)
+            )
+            for page in range(2, nb_pages_to_query + 1)
+        ]
+        try:
+            for next_response in asyncio.as_completed(pending):
+                yield await next_response
+        finally:
+            # Pages left when the consumer stops early are not fetched
+            for task in pending:
+                task.cancel()
+
+    async def fetch_all_pages(
+        self, query: str, language: str = None, max_pages: int = 1
+    ) -> dict:
+        """Fetch every page of a query, concatenating the articles in a single response"""
+        responses = [
+            response async for response in self.iter_pages(query, language, max_pages)
+        ]
+        if responses[0]["status"] == "error":
+            return responses[0]
+        return {
+            "status": "ok",
+            "totalResults": responses[0]["totalResults"],
+            "articles": [
+                article
+                for response in responses
+                if response["status"] == "ok"
+                for article in response["articles"]
+            ],
+        }
+
+    async def fetch_keywords(
+        self, keywords: list[str], language: str = None, max_pages: int = 1
+    ) -> dict[str, dict]:
+        """Fetch every page of several queries concurrently, keyed by query"""
+        responses = await asyncio.gather(
+            *[
+                self.fetch_all_pages(query, language=language, max_pages=max_pages)
+                for query in keywords
+            ],
+            return_exceptions=True,
+        )
+        # A failing keyword does not discard the pages fetched for the others
+        return {
+            query: (
+                {"status": "error", "message": repr(response)}
+                if isinstance(response, BaseException)
+                else response
+            )
+            for query, response in zip(keywords, responses)
+        }
+
+
+_client = None
+
+
+def get_client() -> AsyncNewsApiClient:
+    """Return the client shared by the whole process, created on first use"""
+    global _client
+    if _client is None:
+        _client = AsyncNewsApiClient()
+    return _client
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
@@ -0,0 +1,232 @@
+import asyncio
+import gzip
+import hashlib
+import os
+import weakref
+from html.parser import HTMLParser
+from pathlib import Path
+from urllib.parse import urlsplit
+import httpx
+import monitoring
+from processing.pre_process import canonicalize_url
+
+# Replace the truncated content of the news api by the text of the article page
+FETCH_FULL_TEXT = os.getenv("FETCH_FULL_TEXT", "false").lower() == "true"
+FULL_TEXT_MAX_CONCURRENCY = int(os.getenv("FULL_TEXT_MAX_CONCURRENCY", "16"))
+# Pages requested at the same time from a single host
+FULL_TEXT_MAX_PER_HOST = int(os.getenv("FULL_TEXT_MAX_PER_HOST", "2"))
+FULL_TEXT_TIMEOUT = float(os.getenv("FULL_TEXT_TIMEOUT", "10"))
+FULL_TEXT_CACHE_DIR = Path(os.getenv("FULL_TEXT_CACHE_DIR", "./full_text_cache"))
+USER_AGENT = "detect-synthetic-news/1.0"
+
+# Elements whose text is never part of the article body
+SKIPPED_TAGS = {
+    "script",
+    "style",
+    "noscript",
+    "nav",
+    "header",
+    "footer",
+    "aside",
+    "form",
+    "figure",
+}
+
+
+class _ParagraphParser(HTMLParser):
+    """Collect the paragraphs of a page, those inside <article> apart"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.paragraphs = []
+        self.article_paragraphs = []
+        self._skipped_depth = 0
+        self._article_depth = 0
+        self._paragraph = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIPPED_TAGS:
+            self._skipped_depth += 1
+        elif tag == "article":
+            self._article_depth += 1
+        elif tag == "p" and not self._skipped_depth:
+            self._close_paragraph()
+            self._paragraph = []
+        elif tag == "br" and self._paragraph is not None:
+            self._paragraph.append(" ")
+
+    def handle_endtag(self, tag):
+        if tag in SKIPPED_TAGS:
+            self._skipped_depth = max(0, self._skipped_depth - 1)
+        elif tag == "article":
+            self._close_paragraph()
+            self._article_depth = max(0, self._article_depth - 1)
+        elif tag == "p":
+            self._close_paragraph()
+
+    def handle_data(self, data):
+        if self._paragraph is not None and not self._skipped_depth:
+            self._paragraph.append(data)
+
+    def _close_paragraph(self):
+        if self._paragraph is None:
+            return
+        paragraph = " ".join("".join(self._paragraph).split())
+        if paragraph:
+            self.paragraphs.append(paragraph)
+            if self._article_depth:
+                self.article_paragraphs.append(paragraph)
+        self._paragraph = None
+
+    def close(self):
+        super().close()
+        self._close_paragraph()
+
+
+def extract_main_text(html: str) -> str:
+    """Extract the body of an article from its html page
+
+    Args:
+        html (str): html of the article page
+
+    Returns:
+        str: paragraphs of the <article> element when the page has one, else every
+        paragraph outside of navigation, headers and footers, separated by new lines
+    """
+    parser = _ParagraphParser()
+    parser.feed(html)
+    parser.close()
+    return "\n".join(parser.article_paragraphs or parser.paragraphs)
+
+
+class PageCache:
+    """Gzipped article pages kept on disk, keyed by the hash of their canonical url"""
+
+    def __init__(self, directory: Path = FULL_TEXT_CACHE_DIR):
+        self.directory = Path(directory)
+
+    def _path(self, url: str) -> Path:
+        key = hashlib.sha256(canonicalize_url(url).encode("UTF-8")).hexdigest()
+        return self.directory / key[:2] / f"{key}.html.gz"
+
+    def get(self, url: str) -> str | None:
+        try:
+            return gzip.decompress(self._path(url).read_bytes()).decode("UTF-8")
+        except (FileNotFoundError, OSError, EOFError):
+            return None
+
+    def put(self, url: str, html: str):
+        path = self._path(url)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Written aside then renamed so a concurrent reader never sees half a page
+        temporary_path = path.with_suffix(f".{os.getpid()}.tmp")
+        temporary_path.write_bytes(gzip.compress(html.encode("UTF-8")))
+        temporary_path.replace(path)
+
+
+class FullTextFetcher:
+    """Fetch article pages concurrently through one pool, a few pages per host at a time"""
+
+    def __init__(
+        self,
+        max_concurrency: int = FULL_TEXT_MAX_CONCURRENCY,
+        max_per_host: int = FULL_TEXT_MAX_PER_HOST,
+        timeout: float = FULL_TEXT_TIMEOUT,
+        cache: PageCache | None = None,
+    ):
+        self.max_per_host = max_per_host
+        self.cache = cache or PageCache()
+        self.stats = {"cache_hits": 0, "downloads": 0, "failures": 0}
+        # Semaphores are dropped once no request of their host is in flight
+        self._host_semaphores = weakref.WeakValueDictionary()
+        self._client = httpx.AsyncClient(
+            timeout=timeout,
+            follow_redirects=True,
+            headers={"User-Agent": USER_AGENT},
+            limits=httpx.Limits(
+                max_connections=max_concurrency,
+                max_keepalive_connections=max_concurrency,
+            ),
+        )
+
+    async def close(self):
+        await self._client.aclose()
+
+    def _host_semaphore(self, url: str) -> asyncio.Semaphore:
+        host = urlsplit(url).netloc.lower()
+        semaphore = self._host_semaphores.get(host)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.max_per_host)
+            self._host_semaphores[host] = semaphore
+        return semaphore
+
+    async def fetch_html(self, url: str) -> str | None:
+        """Return the html of a page, from the disk cache when it was already downloaded"""
+        try:
+            html = await asyncio.to_thread(self.cache.get, url)
+            if html is not None:
+                self.stats["cache_hits"] += 1
+                return html
+            async with self._host_semaphore(url):
+                with monitoring.timed(
+                    monitoring.FETCH_SECONDS, endpoint="article_page"
+                ):
+                    response = await self._client.get(url)
+            response.raise_for_status()
+            html = response.text
+        # A malformed url or an undecodable page only loses the text of its article
+        except (httpx.HTTPError, httpx.InvalidURL, ValueError):
+            self.stats["failures"] += 1
+            return None
+        self.stats["downloads"] += 1
+        await asyncio.to_thread(self.cache.put, url, html)
+        return html
+
+    async def fetch_text(self, url: str) -> str | None:
+        html = await self.fetch_html(url)
+        if html is None:
+            return None
+        # Parsing is CPU bound, it runs in a thread to keep the event loop free
+        return await asyncio.to_thread(extract_main_text, html) or None
+
+    async def fetch_texts(self, urls: list[str]) -> list[str | None]:
+        """Fetch the main text of every page concurrently, None for unavailable pages"""
+        return await asyncio.gather(*[self.fetch_text(url) for url in urls])
+
+
+async def complete_articles(fetcher: FullTextFetcher, articles: list[dict]) -> int:
+    """Replace the truncated content of the articles by the text of their page
+
+    Args:
+        fetcher (FullTextFetcher): fetcher of the article pages
+        articles (list[dict]): pre-processed articles metadata
+
+    Returns:
+        int: number of articles whose content was replaced
+    """
+    texts = await fetcher.fetch_texts([article["article_url"] for article in articles])
+    nb_completed = 0
+    for article, text in zip(articles, texts):
+        # Pages without a usable body keep the snippet of the news api
+        if text and len(text) > len(article["article_content"] or ""):
+            article["article_content"] = text
+            nb_completed += 1
+    return nb_completed
+
+
+_fetcher = None
+
+
+def get_fetcher() -> FullTextFetcher:
+    """Return the fetcher shared by the whole process, created on first use"""
+    global _fetcher
+    if _fetcher is None:
+        _fetcher = FullTextFetcher()
+    return _fetcher
+
+
+async def close_fetcher():
+    global _fetcher
+    if _fetcher is not None:
+        await _fetcher.close()
+        _fetcher = None
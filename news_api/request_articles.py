@@ -6,6 +6,8 @@ import requests
 
 load_dotenv()
 
+NEWS_API_BASE_URL = os.getenv("NEWS_API_BASE_URL", "https://newsapi.org/v2")
+
 top_news_papers = "usa-today, the-wall-street-journal, the-washington-post, time"
 top_cable_news = "cnn, msnbc, fox-news"
 top_tech_news = "the-verge, wired, techcrunch, hacker-news"
@@ -22,7 +24,7 @@ def fetch_top_news_articles(
 ) -> Tuple[str, int, dict]:
     # Prepare request url
     api_key = os.getenv("NEWS_API_KEY")
-    url = f"https://newsapi.org/v2/top-headlines?apiKey={api_key}"
+    url = f"{NEWS_API_BASE_URL}/top-headlines?apiKey={api_key}"
     # Specify the url request if needed
     if category is not None:
         request_category = f"category={category}"
@@ -36,28 +38,49 @@ def fetch_top_news_articles(
     return response.json()
 
 
-def fetch_news_articles_based_on_query(
-    # from_date: str = "2023-09-01",
+def build_query_params(
     language: str = None,
     query: str = None,
     category: str = None,
     page: int = 1,
-) -> Tuple[str, int, dict]:
-    # Prepare request url
-    api_key = os.getenv("NEWS_API_KEY")
+    from_date: datetime = None,
+    sort_by: str = None,
+) -> dict:
+    # Articles published during the last 30 days from the selected sources
     month_to_date = datetime.today() - timedelta(days=30)
-    url = f"https://newsapi.org/v2/everything?from={month_to_date}&page={page}&sources={NEWS_SOURCES_SELECTOR}&apiKey={api_key}"
+    # Incremental syncs only ask for the articles published since the last one
+    if from_date is not None:
+        month_to_date = max(month_to_date, from_date)
+    params = {
+        "from": month_to_date.strftime("%Y-%m-%dT%H:%M:%S"),
+        "page": page,
+        "sources": NEWS_SOURCES_SELECTOR,
+    }
+    if sort_by is not None:
+        params["sortBy"] = sort_by
     # Specify the url request if needed
     if category is not None:
-        request_category = f"category={category}"
-        url += f"&{request_category}"
+        params["category"] = category
     if language is not None:
-        request_country = f"language={language}"
-        url += f"&{request_country}"
+        params["language"] = language
     if query is not None:
-        request_query = f"q={query}"
-        url += f"&{request_query}"
+        params["q"] = query
+    return params
+
+
+def fetch_news_articles_based_on_query(
+    # from_date: str = "2023-09-01",
+    language: str = None,
+    query: str = None,
+    category: str = None,
+    page: int = 1,
+) -> Tuple[str, int, dict]:
+    # Prepare request url
+    api_key = os.getenv("NEWS_API_KEY")
+    url = f"{NEWS_API_BASE_URL}/everything"
+    params = build_query_params(language, query, category, page)
+    params["apiKey"] = api_key
 
     # API Call
-    response = requests.get(url)
+    response = requests.get(url, params=params)
     return response.json()
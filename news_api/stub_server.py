@@ -0,0 +1,105 @@
+"""Local stand-in for the news api serving the bundled responses
+
+Run it with `python -m news_api.stub_server --port 8001` and point the API to it
+with `NEWS_API_BASE_URL=http://127.0.0.1:8001/v2`. With `--serve-articles` the
+urls of the articles point to html pages served by the stub, for the full text stage.
+"""
+
+import argparse
+import html
+import json
+import random
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlparse
+
+RESPONSE_FILE = (
+    Path(__file__).resolve().parent.parent / "api_response_top_headlines.json"
+)
+
+
+def render_article_page(article: dict, nb_paragraphs: int = 12) -> str:
+    """Render an article as a page with navigation, a long body and a footer"""
+    text = " ".join(
+        article.get(key) or "" for key in ("title", "description", "content")
+    )
+    paragraphs = "".join(
+        f"<p>{html.escape(text)} Paragraph {index}.</p>"
+        for index in range(nb_paragraphs)
+    )
+    return (
+        "<html><head><title>{title}</title><script>var tracker = 1;</script></head>"
+        "<body><nav><p>Home | World | Tech</p></nav>"
+        "<article><h1>{title}</h1>{paragraphs}</article>"
+        "<footer><p>All rights reserved</p></footer></body></html>"
+    ).format(title=html.escape(article.get("title") or ""), paragraphs=paragraphs)
+
+
+def make_handler(payload: bytes, error_rate: float, pages: dict[str, bytes] = None):
+    pages = pages or {}
+
+    class StubNewsApiHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send(
+            self, status: int, body: bytes, content_type: str = "application/json"
+        ):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            path = urlparse(self.path).path
+            if path in pages:
+                self._send(200, pages[path], "text/html; charset=utf-8")
+            elif path not in ("/v2/everything", "/v2/top-headlines"):
+                self._send(404, b'{"status": "error", "message": "Not found"}')
+            # Simulate the rate limiting of the real api to exercise retries
+            elif random.random() < error_rate:
+                self._send(429, b'{"status": "error", "message": "Too many requests"}')
+            else:
+                self._send(200, payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    return StubNewsApiHandler
+
+
+def serve(
+    host: str = "127.0.0.1",
+    port: int = 8001,
+    response_file: Path = RESPONSE_FILE,
+    error_rate: float = 0.0,
+    serve_articles: bool = False,
+) -> ThreadingHTTPServer:
+    response = json.loads(Path(response_file).read_text())
+    pages = {}
+    if serve_articles:
+        for index, article in enumerate(response["articles"]):
+            path = f"/articles/{index}"
+            pages[path] = render_article_page(article).encode("UTF-8")
+            article["url"] = f"http://{host}:{port}{path}"
+    payload = json.dumps(response).encode("UTF-8")
+    return ThreadingHTTPServer((host, port), make_handler(payload, error_rate, pages))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--response-file", type=Path, default=RESPONSE_FILE)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--serve-articles", action="store_true")
+    args = parser.parse_args()
+    server = serve(
+        args.host,
+        args.port,
+        args.response_file,
+        args.error_rate,
+        args.serve_articles,
+    )
+    print(f"Serving {args.response_file.name} on http://{args.host}:{args.port}/v2")
+    server.serve_forever()
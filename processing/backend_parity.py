@@ -0,0 +1,97 @@
+"""Compare an inference backend against the torch baseline on a fixed corpus
+
+Run it with `python -m processing.backend_parity --backend onnx-int8`, the corpus
+is made of the titles, descriptions and contents of the bundled news api responses.
+"""
+
+import argparse
+import json
+import time
+from pathlib import Path
+from . import batch_inference, inference_backends, model_registry, pre_process
+
+CORPUS_FILES = [
+    Path(__file__).resolve().parent.parent / "api_response_top_headlines.json",
+    Path(__file__).resolve().parent.parent / "api_like_responses_generated_by_gpt.json",
+]
+
+
+def load_corpus(files: list[Path] = CORPUS_FILES) -> list[str]:
+    texts = []
+    for file in files:
+        for article in json.loads(Path(file).read_text())["articles"]:
+            for key in ("title", "description", "content"):
+                if article.get(key):
+                    texts.append(pre_process.clean_article_metadata(article[key]))
+    return texts
+
+
+def _timed_classify(detector, texts: list[str]) -> tuple[list[dict], float]:
+    started_at = time.perf_counter()
+    detections = batch_inference.classify_texts(detector, texts)
+    return detections, time.perf_counter() - started_at
+
+
+def compare_backends(
+    model_name: str, backend: str, texts: list[str], baseline: str = "torch"
+) -> dict:
+    """Labelize the corpus with both backends and report how much they agree
+
+    Args:
+        model_name (str): huggingface model id of the detector
+        backend (str): backend checked
+        texts (list[str]): fixed corpus
+        baseline (str, optional): reference backend. Defaults to "torch".
+
+    Returns:
+        dict: label agreement, score deltas and throughput of both backends
+    """
+    reference = inference_backends.load_detector(model_name, baseline)
+    candidate = inference_backends.load_detector(model_name, backend)
+    # Warm up both backends so the first call does not weigh on the throughput
+    reference(texts[:1])
+    candidate(texts[:1])
+    reference_detections, reference_seconds = _timed_classify(reference, texts)
+    candidate_detections, candidate_seconds = _timed_classify(candidate, texts)
+    agreements = [
+        expected["label"] == detection["label"]
+        for expected, detection in zip(reference_detections, candidate_detections)
+    ]
+    score_deltas = [
+        abs(expected["score"] - detection["score"])
+        for expected, detection, agree in zip(
+            reference_detections, candidate_detections, agreements
+        )
+        if agree
+    ]
+    return {
+        "model_name": model_name,
+        "baseline": baseline,
+        "backend": backend,
+        "corpus_size": len(texts),
+        "label_agreement": sum(agreements) / len(texts) if texts else 1.0,
+        "mean_score_delta": (
+            sum(score_deltas) / len(score_deltas) if score_deltas else 0.0
+        ),
+        "max_score_delta": max(score_deltas, default=0.0),
+        "baseline_texts_per_second": len(texts) / reference_seconds,
+        "backend_texts_per_second": len(texts) / candidate_seconds,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--model-name", default=model_registry.DETECTOR_MODELS[0])
+    parser.add_argument(
+        "--backend",
+        default=inference_backends.INFERENCE_BACKEND,
+        choices=list(inference_backends.BACKENDS),
+    )
+    parser.add_argument(
+        "--baseline", default="torch", choices=list(inference_backends.BACKENDS)
+    )
+    args = parser.parse_args()
+    report = compare_backends(
+        args.model_name, args.backend, load_corpus(), args.baseline
+    )
+    print(json.dumps(report, indent=4))
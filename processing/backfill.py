@@ -0,0 +1,295 @@
+"""Backfill the database from archived news api responses
+
+Run it with `python -m processing.backfill responses/*.json --searched-keywords "deep learning"`.
+Each file holds a news api response, its articles are parsed incrementally
+(with ijson when it is installed), pre-processed by a pool of processes,
+labelized in batches and bulk inserted. The progress is saved in a checkpoint
+file after every stored batch, running the command again resumes from there.
+"""
+
+import argparse
+import json
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import monitoring
+from database import crud, database, models, writer
+from . import labelize, pre_process
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_CHECKPOINT_FILE = Path(
+    os.getenv("BACKFILL_CHECKPOINT_FILE", "./backfill_checkpoint.json")
+)
+# Raw articles pre-processed by a worker in one task
+BACKFILL_CHUNK_SIZE = int(os.getenv("BACKFILL_CHUNK_SIZE", "2000"))
+# Number of articles labelized and stored together, the checkpoint granularity
+BACKFILL_BATCH_SIZE = int(os.getenv("BACKFILL_BATCH_SIZE", "2000"))
+STAGES = ["parse", "pre_process", "labelize", "store"]
+
+
+def iter_articles(file: Path):
+    """Yield the articles of a news api response one by one
+
+    Without ijson the whole file is loaded in memory first.
+    """
+    with open(file, "rb") as response:
+        if ijson is not None:
+            yield from ijson.items(response, "articles.item", use_float=True)
+        else:
+            yield from json.load(response)["articles"]
+
+
+def _pre_process_chunk(searched_keywords: str, articles: list[dict]) -> tuple:
+    # Runs in a worker process, its duration is sent back for the report
+    started_at = time.perf_counter()
+    prepared_articles = pre_process.select_and_prepare_articles(
+        searched_keywords, articles
+    )
+    return prepared_articles, time.perf_counter() - started_at
+
+
+class Checkpoint:
+    """Number of articles of each file already stored, saved after every batch"""
+
+    def __init__(self, path: Path = BACKFILL_CHECKPOINT_FILE):
+        self.path = Path(path)
+        self.files = (
+            json.loads(self.path.read_text())["files"] if self.path.exists() else {}
+        )
+
+    def articles_done(self, file: Path) -> int:
+        return self.files.get(str(Path(file).resolve()), {}).get("articles_done", 0)
+
+    def is_completed(self, file: Path) -> bool:
+        return self.files.get(str(Path(file).resolve()), {}).get("completed", False)
+
+    def save(self, file: Path, articles_done: int, completed: bool = False):
+        self.files[str(Path(file).resolve())] = {
+            "articles_done": articles_done,
+            "completed": completed,
+        }
+        # Written aside then renamed so an interruption never corrupts it
+        temporary_path = self.path.with_suffix(".tmp")
+        temporary_path.write_text(json.dumps({"files": self.files}, indent=4))
+        temporary_path.replace(self.path)
+
+
+class BackfillReport:
+    """Articles handled and time spent by each stage"""
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.started_at = time.perf_counter()
+        self.articles = dict.fromkeys(STAGES, 0)
+        self.seconds = dict.fromkeys(STAGES, 0.0)
+        self.articles_stored = 0
+
+    def record(self, stage: str, nb_articles: int, seconds: float):
+        self.articles[stage] += nb_articles
+        self.seconds[stage] += seconds
+
+    def to_dict(self) -> dict:
+        elapsed = time.perf_counter() - self.started_at
+        stages = {}
+        for stage in STAGES:
+            # Pre-processing time is summed over the workers running side by side
+            seconds = self.seconds[stage] / (
+                self.workers if stage == "pre_process" else 1
+            )
+            stages[stage] = {
+                "articles": self.articles[stage],
+                "seconds": round(seconds, 3),
+                "articles_per_second": (
+                    round(self.articles[stage] / seconds, 1) if seconds else None
+                ),
+            }
+        return {
+            "articles_parsed": self.articles["parse"],
+            "articles_stored": self.articles_stored,
+            "seconds": round(elapsed, 3),
+            "articles_per_second": (
+                round(self.articles["parse"] / elapsed, 1) if elapsed else None
+            ),
+            "stages": stages,
+        }
+
+
+def _iter_chunks(file: Path, skip: int, chunk_size: int, report: BackfillReport):
+    chunk = []
+    started_at = time.perf_counter()
+    for index, article in enumerate(iter_articles(file)):
+        # Articles stored by a previous run are parsed but not processed again
+        if index < skip:
+            continue
+        chunk.append(article)
+        if len(chunk) == chunk_size:
+            report.record("parse", len(chunk), time.perf_counter() - started_at)
+            yield chunk
+            chunk = []
+            started_at = time.perf_counter()
+    if chunk:
+        report.record("parse", len(chunk), time.perf_counter() - started_at)
+        yield chunk
+
+
+def _labelize_and_store(db, articles: list[dict], report: BackfillReport) -> int:
+    unique_articles = {article["article_id"]: article for article in articles}
+    existing_ids = crud.get_existing_article_ids(db, list(unique_articles))
+    new_articles = [
+        article
+        for article_id, article in unique_articles.items()
+        if article_id not in existing_ids
+    ]
+    if not new_articles:
+        return 0
+    started_at = time.perf_counter()
+    labelize.labelize_articles(new_articles, db=db)
+    report.record("labelize", len(new_articles), time.perf_counter() - started_at)
+    started_at = time.perf_counter()
+    with monitoring.timed(
+        monitoring.DB_COMMIT_SECONDS, operation="backfill_store_articles"
+    ):
+        rows, chunk_reports = (
+            writer.get_writer().submit(crud.bulk_insert_articles, new_articles).result()
+        )
+    crud.log_stored_articles(chunk_reports)
+    report.record("store", len(new_articles), time.perf_counter() - started_at)
+    return len(rows)
+
+
+def backfill_file(
+    file: Path,
+    searched_keywords: str,
+    executor: ProcessPoolExecutor,
+    checkpoint: Checkpoint,
+    report: BackfillReport,
+    chunk_size: int = BACKFILL_CHUNK_SIZE,
+    batch_size: int = BACKFILL_BATCH_SIZE,
+):
+    """Pre-process, labelize and store the articles of one file from its checkpoint
+
+    Chunks are pre-processed by the workers while the previous batch is
+    labelized, at most two chunks per worker are in flight at a time.
+    """
+    articles_done = checkpoint.articles_done(file)
+    db = database.ReadSessionLocal()
+    pending = deque()
+    batch = []
+    # Raw articles whose prepared articles are in the batch, not stored yet
+    batch_raw_articles = 0
+
+    def store_batch():
+        nonlocal articles_done, batch, batch_raw_articles
+        report.articles_stored += _labelize_and_store(db, batch, report)
+        articles_done += batch_raw_articles
+        checkpoint.save(file, articles_done)
+        logger.info("%s: %d articles done", file, articles_done)
+        batch = []
+        batch_raw_articles = 0
+
+    def collect_chunk():
+        nonlocal batch, batch_raw_articles
+        nb_raw_articles, future = pending.popleft()
+        prepared_articles, seconds = future.result()
+        report.record("pre_process", nb_raw_articles, seconds)
+        batch += prepared_articles
+        batch_raw_articles += nb_raw_articles
+        if batch_raw_articles >= batch_size:
+            store_batch()
+
+    try:
+        for chunk in _iter_chunks(file, articles_done, chunk_size, report):
+            pending.append(
+                (
+                    len(chunk),
+                    executor.submit(_pre_process_chunk, searched_keywords, chunk),
+                )
+            )
+            if len(pending) >= 2 * report.workers:
+                collect_chunk()
+        while pending:
+            collect_chunk()
+        if batch_raw_articles:
+            store_batch()
+        checkpoint.save(file, articles_done, completed=True)
+    finally:
+        for _, future in pending:
+            future.cancel()
+        db.close()
+
+
+def backfill(
+    files: list[Path],
+    searched_keywords: str | None = None,
+    workers: int | None = None,
+    checkpoint_file: Path = BACKFILL_CHECKPOINT_FILE,
+    chunk_size: int = BACKFILL_CHUNK_SIZE,
+    batch_size: int = BACKFILL_BATCH_SIZE,
+) -> dict:
+    """Load archived news api responses into the database
+
+    Args:
+        files (list[Path]): news api responses to load
+        searched_keywords (str, optional): keywords the responses were searched
+            with. Defaults to the name of each file.
+        workers (int, optional): pre-processing processes. Defaults to the number of CPUs.
+        checkpoint_file (Path, optional): progress saved between runs
+        chunk_size (int, optional): raw articles per pre-processing task
+        batch_size (int, optional): articles labelized and stored together
+
+    Returns:
+        dict: articles handled, time spent and throughput of each stage
+    """
+    workers = workers or os.cpu_count() or 1
+    checkpoint = Checkpoint(checkpoint_file)
+    report = BackfillReport(workers)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for file in files:
+            if checkpoint.is_completed(file):
+                logger.info("%s: already loaded, skipped", file)
+                continue
+            backfill_file(
+                file,
+                searched_keywords or Path(file).stem,
+                executor,
+                checkpoint,
+                report,
+                chunk_size,
+                batch_size,
+            )
+    return report.to_dict()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("files", nargs="+", type=Path)
+    parser.add_argument("--searched-keywords", default=None)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument(
+        "--checkpoint-file", type=Path, default=BACKFILL_CHECKPOINT_FILE
+    )
+    parser.add_argument("--chunk-size", type=int, default=BACKFILL_CHUNK_SIZE)
+    parser.add_argument("--batch-size", type=int, default=BACKFILL_BATCH_SIZE)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    models.Base.metadata.create_all(bind=database.engine)
+    database.add_missing_columns(models.Base.metadata)
+    database.create_missing_indexes(models.Base.metadata)
+    report = backfill(
+        args.files,
+        args.searched_keywords,
+        args.workers,
+        args.checkpoint_file,
+        args.chunk_size,
+        args.batch_size,
+    )
+    print(json.dumps(report, indent=4))
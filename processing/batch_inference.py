@@ -0,0 +1,180 @@
+import hashlib
+import json
+import os
+import time
+import monitoring
+
+INFERENCE_BATCH_SIZE = int(os.getenv("INFERENCE_BATCH_SIZE", "32"))
+# Upper token length of each bucket, texts of similar length are batched together
+LENGTH_BUCKETS = [32, 64, 128, 256, 512]
+DEFAULT_MAX_LENGTH = 512
+# Texts longer than the detector input are scored with overlapping token windows
+INFERENCE_WINDOW_STRIDE = int(os.getenv("INFERENCE_WINDOW_STRIDE", "64"))
+INFERENCE_MAX_WINDOWS = int(os.getenv("INFERENCE_MAX_WINDOWS", "16"))
+
+_signatures = {}
+
+
+def get_max_length(pipe) -> int:
+    """Return the number of tokens the detector accepts as input"""
+    max_length = pipe.tokenizer.model_max_length
+    # Tokenizers without a known limit report a huge sentinel value
+    if max_length is None or max_length > 100_000:
+        max_length = getattr(pipe.config, "max_position_embeddings", None)
+    return min(max_length or DEFAULT_MAX_LENGTH, DEFAULT_MAX_LENGTH)
+
+
+def bucket_by_length(lengths: list[int], buckets: list[int] = LENGTH_BUCKETS) -> list:
+    """Sort texts by token length and group their indexes into length buckets
+
+    Args:
+        lengths (list[int]): number of tokens of each text
+        buckets (list[int], optional): upper length of each bucket. Defaults to LENGTH_BUCKETS.
+
+    Returns:
+        list[list[int]]: indexes of the texts of each non empty bucket, shortest first
+    """
+    grouped = [[] for _ in range(len(buckets) + 1)]
+    for index in sorted(range(len(lengths)), key=lambda i: lengths[i]):
+        bucket = next(
+            (b for b, upper in enumerate(buckets) if lengths[index] <= upper),
+            len(buckets),
+        )
+        grouped[bucket].append(index)
+    return [indexes for indexes in grouped if indexes]
+
+
+def _probabilities(pipe, encoded):
+    import numpy as np
+
+    logits = pipe.predict_logits(encoded)
+    # Softmax over the labels, shifted by the max logit for stability
+    exponentials = np.exp(logits - logits.max(axis=-1, keepdims=True))
+    return exponentials / exponentials.sum(axis=-1, keepdims=True)
+
+
+def tokenizer_signature(pipe) -> tuple:
+    """Return what identifies the token ids produced for a detector
+
+    Detectors with the same signature can share the tokenization of a batch.
+    """
+    tokenizer = pipe.tokenizer
+    signature = _signatures.get(id(tokenizer))
+    if signature is None:
+        vocab = json.dumps(sorted(tokenizer.get_vocab().items())).encode("UTF-8")
+        signature = (
+            type(tokenizer).__name__,
+            get_max_length(pipe),
+            hashlib.sha256(vocab).hexdigest(),
+        )
+        _signatures[id(tokenizer)] = signature
+    return signature
+
+
+def tokenize_texts(pipe, texts: list[str]) -> list[list[dict]]:
+    """Tokenize texts without padding, in windows of the max length of the detector
+
+    Texts longer than the detector input are split into windows overlapping by
+    INFERENCE_WINDOW_STRIDE tokens, up to INFERENCE_MAX_WINDOWS per text.
+
+    Args:
+        pipe (_type_): instance of the detector model
+        texts (list[str]): texts to tokenize
+
+    Returns:
+        list[list[dict]]: input ids and attention mask of the windows of each text
+    """
+    if not texts:
+        return []
+    max_length = get_max_length(pipe)
+    tokenized = pipe.tokenizer(
+        [text or "" for text in texts],
+        truncation=True,
+        max_length=max_length,
+        stride=min(INFERENCE_WINDOW_STRIDE, max_length // 2),
+        return_overflowing_tokens=True,
+    )
+    tokenized = dict(tokenized)
+    # Only fast tokenizers map the windows back to their text, others truncate
+    text_indexes = tokenized.pop("overflow_to_sample_mapping", range(len(texts)))
+    tokenized.pop("overflowing_tokens", None)
+    tokenized.pop("num_truncated_tokens", None)
+    windows = [[] for _ in texts]
+    for window, text_index in enumerate(text_indexes):
+        if len(windows[text_index]) < INFERENCE_MAX_WINDOWS:
+            windows[text_index].append(
+                {key: values[window] for key, values in tokenized.items()}
+            )
+    return windows
+
+
+def classify_encodings(
+    pipe, encodings: list[list[dict]], batch_size: int | None = None
+) -> list[dict]:
+    """Run tokenized texts through the detector using length bucketed micro-batches
+
+    The label probabilities of the windows of a text are averaged, weighted by
+    their number of tokens.
+
+    Args:
+        pipe (_type_): instance of the detector model
+        encodings (list[list[dict]]): windows of the tokenized texts, see tokenize_texts
+        batch_size (int, optional): size of the micro-batches. Defaults to INFERENCE_BATCH_SIZE.
+
+    Returns:
+        list[dict]: label and score of each text, in the order of the encodings
+    """
+    import numpy as np
+
+    batch_size = batch_size or INFERENCE_BATCH_SIZE
+    windows = [window for text_windows in encodings for window in text_windows]
+    lengths = [len(window["input_ids"]) for window in windows]
+    probabilities = [None] * len(windows)
+    for indexes in bucket_by_length(lengths):
+        for start in range(0, len(indexes), batch_size):
+            batch_indexes = indexes[start : start + batch_size]
+            # Micro-batches are padded to their longest window only
+            encoded = pipe.tokenizer.pad(
+                [windows[index] for index in batch_indexes], return_tensors="np"
+            )
+            started_at = time.perf_counter()
+            batch_probabilities = _probabilities(pipe, encoded)
+            monitoring.observe_inference_batch(
+                getattr(pipe, "model_name", type(pipe).__name__),
+                len(batch_indexes),
+                sum(lengths[index] for index in batch_indexes),
+                time.perf_counter() - started_at,
+            )
+            for index, row in zip(batch_indexes, batch_probabilities):
+                probabilities[index] = row
+    id2label = pipe.config.id2label
+    detections = []
+    start = 0
+    for text_windows in encodings:
+        end = start + len(text_windows)
+        text_probabilities = np.average(
+            probabilities[start:end], axis=0, weights=lengths[start:end]
+        )
+        prediction = int(text_probabilities.argmax())
+        detections.append(
+            {
+                "label": id2label[prediction],
+                "score": float(text_probabilities[prediction]),
+            }
+        )
+        start = end
+    return detections
+
+
+def classify_texts(pipe, texts: list[str], batch_size: int | None = None) -> list[dict]:
+    """Run a batch of texts through the detector using length bucketed micro-batches
+
+    Args:
+        pipe (_type_): instance of the detector model
+        texts (list[str]): texts to labelize
+        batch_size (int, optional): size of the micro-batches. Defaults to INFERENCE_BATCH_SIZE.
+
+    Returns:
+        list[dict]: label and score of each text, in the order of the texts
+    """
+    return classify_encodings(pipe, tokenize_texts(pipe, texts), batch_size)
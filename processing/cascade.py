@@ -0,0 +1,101 @@
+import os
+import threading
+from . import model_registry
+
+# Texts whose probability of being generated falls in the band go to the full detectors
+CASCADE_UNCERTAINTY_BAND = tuple(
+    float(bound)
+    for bound in os.getenv("CASCADE_UNCERTAINTY_BAND", "0.1,0.9").split(",")
+)
+
+
+def is_enabled() -> bool:
+    return model_registry.CASCADE_FIRST_STAGE_MODEL is not None
+
+
+def fake_probability(detection: dict) -> float:
+    # Detectors return the score of their predicted label only
+    group = model_registry.label_group(detection["label"])
+    if group is None:
+        raise ValueError(f"Unknown label {detection['label']!r}")
+    return detection["score"] if group == "fake" else 1.0 - detection["score"]
+
+
+def is_uncertain(detection: dict, band: tuple[float, float] = None) -> bool:
+    low, high = band or CASCADE_UNCERTAINTY_BAND
+    return low <= fake_probability(detection) <= high
+
+
+class CascadeStats:
+    """Share of the texts escalated from the first stage to the full detectors"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.texts_scored = 0
+        self.texts_escalated = 0
+        self.last_batch = None
+
+    def record(self, texts_scored: int, texts_escalated: int):
+        with self._lock:
+            self.texts_scored += texts_scored
+            self.texts_escalated += texts_escalated
+            self.last_batch = {
+                "texts_scored": texts_scored,
+                "texts_escalated": texts_escalated,
+            }
+
+    def to_dict(self) -> dict:
+        return {
+            "enabled": is_enabled(),
+            "first_stage_model": model_registry.CASCADE_FIRST_STAGE_MODEL,
+            "uncertainty_band": CASCADE_UNCERTAINTY_BAND,
+            "texts_scored": self.texts_scored,
+            "texts_escalated": self.texts_escalated,
+            "escalation_rate": (
+                self.texts_escalated / self.texts_scored if self.texts_scored else 0.0
+            ),
+            "last_batch": self.last_batch,
+        }
+
+
+cascade_stats = CascadeStats()
+
+
+def run_cascade(texts: list[str], detectors: list[tuple], run_detectors) -> dict:
+    """Score every text with the first stage, escalate the uncertain ones
+
+    Args:
+        texts (list[str]): texts to labelize
+        detectors (list[tuple]): (model name, pipeline) of the full detectors
+        run_detectors (Callable): labelizes texts with detectors, returns the
+            detections per model name
+
+    Returns:
+        dict[str, list[dict]]: label, score and stage of each text, per full detector
+    """
+    first_stage_name = model_registry.CASCADE_FIRST_STAGE_MODEL
+    first_stage = model_registry.get_pipeline(first_stage_name)
+    first_detections = run_detectors(texts, [(first_stage_name, first_stage)])[
+        first_stage_name
+    ]
+    escalated_indexes = [
+        index
+        for index, detection in enumerate(first_detections)
+        if is_uncertain(detection)
+    ]
+    full_detections = (
+        run_detectors([texts[index] for index in escalated_indexes], detectors)
+        if escalated_indexes
+        else {model_name: [] for model_name, _ in detectors}
+    )
+    cascade_stats.record(len(texts), len(escalated_indexes))
+    detections = {}
+    for model_name, _ in detectors:
+        # Confident first stage results stand for the result of every full detector
+        model_detections = [
+            {**detection, "stage": "first_pass"} for detection in first_detections
+        ]
+        for index, detection in zip(escalated_indexes, full_detections[model_name]):
+            model_detections[index] = {**detection, "stage": "full"}
+        detections[model_name] = model_detections
+    return detections
@@ -0,0 +1,196 @@
+import asyncio
+import os
+import time
+from collections import deque
+from . import inference_cache, model_registry
+
+# Detector answering /detect, the first configured detector by default
+DETECT_MODEL = os.getenv("DETECT_MODEL", model_registry.DETECTOR_MODELS[0])
+DETECT_MAX_BATCH_SIZE = int(os.getenv("DETECT_MAX_BATCH_SIZE", "32"))
+# Milliseconds the first text of a batch waits for others to join it
+DETECT_MAX_WAIT_MS = float(os.getenv("DETECT_MAX_WAIT_MS", "5"))
+# Texts waiting for a batch, further requests are rejected
+DETECT_MAX_QUEUE_SIZE = int(os.getenv("DETECT_MAX_QUEUE_SIZE", "1024"))
+# Latencies of the last requests used for the percentiles
+LATENCY_WINDOW = 10000
+
+
+class TooManyTextsError(Exception):
+    """A request has more texts than the queue can ever hold"""
+
+
+class QueueFullError(Exception):
+    """The batcher has no room left for the texts of a request"""
+
+
+class BatcherUnavailableError(Exception):
+    """The batcher stopped before the texts of a request were scored"""
+
+
+def _percentile(values: list[float], percentile: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(percentile / 100 * len(ordered)))]
+
+
+class DynamicBatcher:
+    """Coalesce the texts of concurrent requests into batches of the detector
+
+    A batch is sent to the detector once it holds `max_batch_size` texts or once
+    its first text waited `max_wait_ms`, whichever comes first. The forward pass
+    runs in a thread, the event loop keeps accepting requests meanwhile.
+    """
+
+    def __init__(
+        self,
+        model_name: str = DETECT_MODEL,
+        max_batch_size: int = DETECT_MAX_BATCH_SIZE,
+        max_wait_ms: float = DETECT_MAX_WAIT_MS,
+        max_queue_size: int = DETECT_MAX_QUEUE_SIZE,
+    ):
+        self.model_name = model_name
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_queue_size = max_queue_size
+        self.requests = 0
+        self.rejected_requests = 0
+        self.batches = 0
+        self.batched_texts = 0
+        self.failed_batches = 0
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._queue = None
+        self._worker = None
+        self._batch = []
+
+    def _fail_pending(self, error: Exception):
+        # Texts of the batch being scored and of the queue would otherwise wait forever
+        pending = self._batch
+        self._batch = []
+        while self._queue is not None and not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+        for _, future in pending:
+            if not future.done():
+                future.set_exception(error)
+
+    def _ensure_worker(self):
+        # The queue and the worker belong to the event loop of the first request
+        if self._worker is not None and self._worker.done():
+            self._fail_pending(BatcherUnavailableError("The detection worker stopped"))
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+
+    async def detect(self, texts: list[str]) -> list[dict]:
+        """Labelize texts along with the texts of the other pending requests
+
+        Raises:
+            TooManyTextsError: the request has more texts than the queue can hold
+            QueueFullError: the queue has no room for the texts
+            BatcherUnavailableError: the batcher stopped before scoring the texts
+        """
+        if len(texts) > self.max_queue_size:
+            raise TooManyTextsError(
+                f"{len(texts)} texts exceed the queue size of {self.max_queue_size}"
+            )
+        self._ensure_worker()
+        if self._queue.qsize() + len(texts) > self.max_queue_size:
+            self.rejected_requests += 1
+            raise QueueFullError(
+                f"{self._queue.qsize()} texts are waiting, {len(texts)} more do not fit"
+            )
+        started_at = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        futures = [loop.create_future() for _ in texts]
+        for text, future in zip(texts, futures):
+            self._queue.put_nowait((text, future))
+        detections = await asyncio.gather(*futures)
+        self.requests += 1
+        self._latencies.append(time.perf_counter() - started_at)
+        return list(detections)
+
+    async def _next_batch(self) -> list:
+        # Kept on the batcher while it fills, to be failed if the worker stops
+        batch = self._batch = [await self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            # Texts already waiting join without yielding to the event loop
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        # Texts of requests which went away are not scored
+        self._batch = [(text, future) for text, future in batch if not future.done()]
+        return self._batch
+
+    def _classify(self, texts: list[str]) -> list[dict]:
+        pipe = model_registry.get_pipeline(self.model_name)
+        return inference_cache.classify_texts_with_cache(
+            None, self.model_name, pipe, texts, self.max_batch_size
+        )
+
+    async def _run(self):
+        try:
+            await self._score_batches()
+        except Exception as error:
+            self._fail_pending(BatcherUnavailableError(repr(error)))
+            raise
+
+    async def _score_batches(self):
+        while True:
+            self._batch = []
+            batch = await self._next_batch()
+            if not batch:
+                continue
+            texts = [text for text, _ in batch]
+            try:
+                detections = await asyncio.to_thread(self._classify, texts)
+            except Exception as error:
+                self.failed_batches += 1
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+            self.batches += 1
+            self.batched_texts += len(batch)
+            for (_, future), detection in zip(batch, detections):
+                if not future.done():
+                    future.set_result(detection)
+
+    async def close(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._worker = None
+        self._fail_pending(BatcherUnavailableError("The detection batcher is closed"))
+
+    def stats(self) -> dict:
+        latencies = list(self._latencies)
+        return {
+            "model_name": self.model_name,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "max_queue_size": self.max_queue_size,
+            "queued_texts": self._queue.qsize() if self._queue is not None else 0,
+            "requests": self.requests,
+            "rejected_requests": self.rejected_requests,
+            "batches": self.batches,
+            "failed_batches": self.failed_batches,
+            "mean_batch_size": (
+                self.batched_texts / self.batches if self.batches else 0.0
+            ),
+            "latency_p50_ms": _percentile(latencies, 50) * 1000,
+            "latency_p99_ms": _percentile(latencies, 99) * 1000,
+        }
+
+
+batcher = DynamicBatcher()
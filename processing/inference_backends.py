@@ -0,0 +1,188 @@
+import inspect
+import os
+from pathlib import Path
+
+# torch, torch-int8 (dynamic quantization), onnx or onnx-int8
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "torch")
+INFERENCE_INTRA_OP_THREADS = int(os.getenv("INFERENCE_INTRA_OP_THREADS", "0"))
+INFERENCE_INTER_OP_THREADS = int(os.getenv("INFERENCE_INTER_OP_THREADS", "0"))
+# Exported onnx models are kept there and reused by the next processes
+ONNX_MODELS_DIR = Path(os.getenv("ONNX_MODELS_DIR", "./onnx_models"))
+
+
+class Detector:
+    """Text classifier backed by a tokenizer, a model config and an inference runtime
+
+    Detectors are called like a transformers pipeline and expose what the batch
+    inference engine needs: `tokenizer`, `config`, `revision` and `predict_logits`.
+    """
+
+    backend = None
+
+    def __init__(self, model_name: str):
+        from transformers import AutoConfig, AutoTokenizer
+
+        self.model_name = model_name
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.config = AutoConfig.from_pretrained(model_name)
+        commit_hash = getattr(self.config, "_commit_hash", None) or "main"
+        # Scores of an optimized backend differ slightly, they are cached apart
+        self.revision = (
+            commit_hash if self.backend == "torch" else f"{commit_hash}+{self.backend}"
+        )
+
+    def predict_logits(self, encoded: dict):
+        """Return the logits of a padded batch as a numpy array"""
+        raise NotImplementedError
+
+    def __call__(self, texts: str | list[str]) -> list[dict]:
+        from . import batch_inference
+
+        return batch_inference.classify_texts(
+            self, [texts] if isinstance(texts, str) else texts
+        )
+
+
+class TorchDetector(Detector):
+    backend = "torch"
+
+    def __init__(self, model_name: str):
+        super().__init__(model_name)
+        from transformers import AutoModelForSequenceClassification
+
+        _set_torch_threads()
+        self.model = AutoModelForSequenceClassification.from_pretrained(model_name)
+        self.model.eval()
+
+    def predict_logits(self, encoded: dict):
+        import torch
+
+        with torch.no_grad():
+            inputs = {key: torch.as_tensor(value) for key, value in encoded.items()}
+            return self.model(**inputs).logits.numpy()
+
+
+class QuantizedTorchDetector(TorchDetector):
+    backend = "torch-int8"
+
+    def __init__(self, model_name: str):
+        super().__init__(model_name)
+        import torch
+
+        # Weights of the linear layers are stored in int8, activations quantized on the fly
+        self.model = torch.quantization.quantize_dynamic(
+            self.model, {torch.nn.Linear}, dtype=torch.qint8
+        )
+
+
+class OnnxDetector(Detector):
+    backend = "onnx"
+
+    def __init__(self, model_name: str):
+        super().__init__(model_name)
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = INFERENCE_INTRA_OP_THREADS
+        options.inter_op_num_threads = INFERENCE_INTER_OP_THREADS
+        options.graph_optimization_level = (
+            onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        )
+        self.session = onnxruntime.InferenceSession(
+            str(self._get_model_path()),
+            sess_options=options,
+            providers=["CPUExecutionProvider"],
+        )
+        self.input_names = [
+            model_input.name for model_input in self.session.get_inputs()
+        ]
+
+    def _get_model_path(self) -> Path:
+        model_dir = ONNX_MODELS_DIR / self.revision.replace("+", "-") / self.model_name
+        model_path = model_dir / "model.onnx"
+        if not model_path.exists():
+            model_dir.mkdir(parents=True, exist_ok=True)
+            export_to_onnx(self.model_name, self.tokenizer, model_path)
+        return model_path
+
+    def predict_logits(self, encoded: dict):
+        import numpy as np
+
+        inputs = {
+            name: np.asarray(encoded[name], dtype=np.int64) for name in self.input_names
+        }
+        return self.session.run(None, inputs)[0]
+
+
+class QuantizedOnnxDetector(OnnxDetector):
+    backend = "onnx-int8"
+
+    def _get_model_path(self) -> Path:
+        model_dir = ONNX_MODELS_DIR / self.revision.replace("+", "-") / self.model_name
+        model_path = model_dir / "model.int8.onnx"
+        if not model_path.exists():
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+
+            model_dir.mkdir(parents=True, exist_ok=True)
+            float_model_path = model_dir / "model.onnx"
+            export_to_onnx(self.model_name, self.tokenizer, float_model_path)
+            quantize_dynamic(
+                str(float_model_path), str(model_path), weight_type=QuantType.QInt8
+            )
+        return model_path
+
+
+BACKENDS = {
+    "torch": TorchDetector,
+    "torch-int8": QuantizedTorchDetector,
+    "onnx": OnnxDetector,
+    "onnx-int8": QuantizedOnnxDetector,
+}
+
+
+def _set_torch_threads():
+    import torch
+
+    if INFERENCE_INTRA_OP_THREADS:
+        torch.set_num_threads(INFERENCE_INTRA_OP_THREADS)
+    if INFERENCE_INTER_OP_THREADS:
+        try:
+            torch.set_num_interop_threads(INFERENCE_INTER_OP_THREADS)
+        except RuntimeError:
+            # Only allowed before the first parallel work of the process
+            pass
+
+
+def export_to_onnx(model_name: str, tokenizer, model_path: Path):
+    """Export a sequence classification model to onnx with dynamic batch and length"""
+    import torch
+    from transformers import AutoModelForSequenceClassification
+
+    model = AutoModelForSequenceClassification.from_pretrained(model_name)
+    model.eval()
+    model.config.return_dict = False
+    sample = tokenizer(["Sample text used to trace the model"], return_tensors="pt")
+    # Graph inputs follow the order of the forward arguments
+    input_names = [
+        name for name in inspect.signature(model.forward).parameters if name in sample
+    ]
+    torch.onnx.export(
+        model,
+        ({name: sample[name] for name in input_names},),
+        str(model_path),
+        input_names=input_names,
+        output_names=["logits"],
+        dynamic_axes={
+            **{name: {0: "batch", 1: "sequence"} for name in input_names},
+            "logits": {0: "batch"},
+        },
+        opset_version=14,
+    )
+
+
+def load_detector(model_name: str, backend: str = INFERENCE_BACKEND) -> Detector:
+    if backend not in BACKENDS:
+        raise ValueError(
+            f"Unknown inference backend {backend}, expected one of {list(BACKENDS)}"
+        )
+    return BACKENDS[backend](model_name)
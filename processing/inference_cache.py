@@ -0,0 +1,159 @@
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from sqlalchemy.orm import Session
+from database import crud, writer
+from . import batch_inference
+
+logger = logging.getLogger(__name__)
+
+# Number of inference results kept in memory in front of the database table
+INFERENCE_CACHE_SIZE = int(os.getenv("INFERENCE_CACHE_SIZE", "50000"))
+
+
+def normalize_text(text: str) -> str:
+    return " ".join((text or "").split())
+
+
+def hash_text(text: str) -> str:
+    return hashlib.sha256(normalize_text(text).encode("UTF-8")).hexdigest()
+
+
+def get_model_revision(pipe) -> str:
+    """Return the commit of the model weights and the backend, results of other revisions are not reused"""
+    return pipe.revision
+
+
+def _log_store_failure(future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.warning("Inference results not stored: %r", future.exception())
+
+
+class InferenceCache:
+    """Bounded LRU of inference results backed by the inference_cache table"""
+
+    def __init__(self, max_size: int = INFERENCE_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.database_hits = 0
+        self.misses = 0
+
+    def _remember(self, key: tuple, detection: tuple[str, float]):
+        self._entries[key] = detection
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def lookup_many(
+        self,
+        db: Session | None,
+        model_name: str,
+        model_revision: str,
+        text_hashes: list[str],
+    ) -> dict[str, tuple[str, float]]:
+        """Return the known (label, score) of each text hash, memory first then database"""
+        found = {}
+        missing = []
+        with self._lock:
+            for text_hash in text_hashes:
+                key = (model_name, model_revision, text_hash)
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    found[text_hash] = self._entries[key]
+                else:
+                    missing.append(text_hash)
+            self.memory_hits += len(found)
+        if missing and db is not None:
+            stored = crud.get_cached_inferences(db, model_name, model_revision, missing)
+            with self._lock:
+                for text_hash, detection in stored.items():
+                    self._remember((model_name, model_revision, text_hash), detection)
+                self.database_hits += len(stored)
+            found.update(stored)
+        with self._lock:
+            self.misses += len(text_hashes) - len(found)
+        return found
+
+    def store_many(
+        self,
+        db: Session | None,
+        model_name: str,
+        model_revision: str,
+        detections: dict[str, tuple[str, float]],
+    ):
+        with self._lock:
+            for text_hash, detection in detections.items():
+                self._remember((model_name, model_revision, text_hash), detection)
+        if db is not None and detections:
+            # Written by the database writer, the session may be read-only.
+            # Inference does not wait for the commit, results are in memory already
+            writer.get_writer().submit(
+                crud.batch_create_cached_inferences,
+                model_name,
+                model_revision,
+                detections,
+            ).add_done_callback(_log_store_failure)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.memory_hits + self.database_hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "memory_hits": self.memory_hits,
+            "database_hits": self.database_hits,
+            "misses": self.misses,
+            "hit_rate": (lookups - self.misses) / lookups if lookups else 0.0,
+        }
+
+
+inference_cache = InferenceCache()
+
+
+def classify_texts_with_cache(
+    db: Session | None,
+    model_name: str,
+    pipe,
+    texts: list[str],
+    batch_size: int | None = None,
+) -> list[dict]:
+    """Labelize texts, only texts never seen by the model go through inference
+
+    Args:
+        db (Session | None): session used to read and write the persistent cache
+        model_name (str): name of the detector
+        pipe (_type_): instance of the detector model
+        texts (list[str]): texts to labelize
+        batch_size (int, optional): size of the inference micro-batches
+
+    Returns:
+        list[dict]: label and score of each text, in the order of the texts
+    """
+    model_revision = get_model_revision(pipe)
+    text_hashes = [hash_text(text) for text in texts]
+    # Identical texts within the batch are only looked up and scored once
+    unique_texts = dict(zip(text_hashes, texts))
+    known = inference_cache.lookup_many(
+        db, model_name, model_revision, list(unique_texts)
+    )
+    unknown_hashes = [text_hash for text_hash in unique_texts if text_hash not in known]
+    detections = batch_inference.classify_texts(
+        pipe, [unique_texts[text_hash] for text_hash in unknown_hashes], batch_size
+    )
+    scored = {
+        text_hash: (detection["label"], detection["score"])
+        for text_hash, detection in zip(unknown_hashes, detections)
+    }
+    inference_cache.store_many(db, model_name, model_revision, scored)
+    known.update(scored)
+    return [
+        {"label": known[text_hash][0], "score": known[text_hash][1]}
+        for text_hash in text_hashes
+    ]
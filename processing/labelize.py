@@ -1,66 +1,249 @@
-from transformers import pipeline
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy.orm import Session
+import monitoring
+from database import crud
+from . import (
+    batch_inference,
+    cascade,
+    inference_cache,
+    model_registry,
+    near_duplicates,
+)
 
+# Labelized fields of an article and the key holding their text
+ARTICLE_FIELDS = {
+    "title": "article_title",
+    "description": "article_description",
+    "content": "article_content",
+}
 
-def enrich_article(article: dict, pipe) -> dict:
-    """Clean data form an article and feed it to the detection model
+
+def detect_texts(
+    texts: list[str],
+    detectors: list[tuple],
+    batch_size: int | None = None,
+    db: Session | None = None,
+) -> dict[str, list[dict]]:
+    """Labelize texts with the detectors, through the cascade when it is enabled
 
     Args:
-        article (dict): a json with the data related to an article
-        pipe (_type_): instance of the detector model
+        texts (list[str]): texts to labelize
+        detectors (list[tuple]): (model name, pipeline) of each detector
+        batch_size (int, optional): size of the inference micro-batches
+        db (Session, optional): session of the persistent inference cache
 
     Returns:
-        dict: article data enriched with a fake / real label and a confidence score
+        dict[str, list[dict]]: label, score and stage of each text, per model name
     """
-    article_title = article.get("article_title")
-    article_description = article.get("article_description")
-    article_content = article.get("article_content")
 
-    # Initialize variables with default values
-    title_detection = ["", 0.0]
-    description_detection = ["", 0.0]
-    content_detection = ["", 0.0]
+    def run_detectors(texts: list[str], detectors: list[tuple]) -> dict:
+        return _run_detectors(texts, detectors, batch_size, db)
+
+    if cascade.is_enabled():
+        return cascade.run_cascade(texts, detectors, run_detectors)
+    return {
+        model_name: [{**detection, "stage": "full"} for detection in detections]
+        for model_name, detections in run_detectors(texts, detectors).items()
+    }
+
+
+def _run_detectors(
+    texts: list[str],
+    detectors: list[tuple],
+    batch_size: int | None = None,
+    db: Session | None = None,
+) -> dict[str, list[dict]]:
+    """Labelize texts with several detectors running concurrently
+
+    Texts already scored by a detector are read from the inference cache. The
+    remaining texts are tokenized once per group of detectors sharing the same
+    tokenizer, then every detector runs in its own thread.
 
-    # Feed article metadata to the Detector
-    title_detection = pipe(article_title)[0]
-    description_detection = pipe(article_description)[0]
-    content_detection = pipe(article_content)[0]
+    Args:
+        texts (list[str]): texts to labelize
+        detectors (list[tuple]): (model name, pipeline) of each detector
+        batch_size (int, optional): size of the inference micro-batches
+        db (Session, optional): session of the persistent inference cache
+
+    Returns:
+        dict[str, list[dict]]: label and score of each text, per model name
+    """
+    text_hashes = [inference_cache.hash_text(text) for text in texts]
+    # Identical texts within the batch are only looked up and scored once
+    unique_texts = dict(zip(text_hashes, texts))
+    known = {}
+    unknown_hashes = {}
+    for model_name, pipe in detectors:
+        known[model_name] = inference_cache.inference_cache.lookup_many(
+            db, model_name, inference_cache.get_model_revision(pipe), list(unique_texts)
+        )
+        unknown_hashes[model_name] = [
+            text_hash
+            for text_hash in unique_texts
+            if text_hash not in known[model_name]
+        ]
+    # Tokenize each text once per tokenizer shared by several detectors
+    encodings = {}
+    for model_name, pipe in detectors:
+        signature = batch_inference.tokenizer_signature(pipe)
+        shared = encodings.setdefault(signature, {})
+        missing = [
+            text_hash
+            for text_hash in unknown_hashes[model_name]
+            if text_hash not in shared
+        ]
+        shared.update(
+            zip(
+                missing,
+                batch_inference.tokenize_texts(
+                    pipe, [unique_texts[text_hash] for text_hash in missing]
+                ),
+            )
+        )
+    with ThreadPoolExecutor(max_workers=max(len(detectors), 1)) as executor:
+        futures = {
+            model_name: executor.submit(
+                batch_inference.classify_encodings,
+                pipe,
+                [
+                    encodings[batch_inference.tokenizer_signature(pipe)][text_hash]
+                    for text_hash in unknown_hashes[model_name]
+                ],
+                batch_size,
+            )
+            for model_name, pipe in detectors
+        }
+    detections = {}
+    for model_name, pipe in detectors:
+        scored = {
+            text_hash: (detection["label"], detection["score"])
+            for text_hash, detection in zip(
+                unknown_hashes[model_name], futures[model_name].result()
+            )
+        }
+        inference_cache.inference_cache.store_many(
+            db, model_name, inference_cache.get_model_revision(pipe), scored
+        )
+        known[model_name].update(scored)
+        detections[model_name] = [
+            {
+                "label": known[model_name][text_hash][0],
+                "score": known[model_name][text_hash][1],
+            }
+            for text_hash in text_hashes
+        ]
+    return detections
 
+
+def _reused_detections(
+    canonical_detections: dict, model_names: list[str]
+) -> dict | None:
+    """Copy the detections of a canonical article, None when a detector is missing"""
+    if any(
+        set(canonical_detections.get(model_name, {})) != set(ARTICLE_FIELDS)
+        for model_name in model_names
+    ):
+        return None
     return {
-        "title_detection_label": title_detection["label"],
-        "title_detection_score": title_detection["score"],
-        "description_detection_label": description_detection["label"],
-        "description_detection_score": description_detection["score"],
-        "content_detection_label": content_detection["label"],
-        "content_detection_score": content_detection["score"],
+        model_name: {
+            field: {
+                "label": canonical_detections[model_name][field]["label"],
+                "score": canonical_detections[model_name][field]["score"],
+                "stage": "near_duplicate",
+            }
+            for field in ARTICLE_FIELDS
+        }
+        for model_name in model_names
     }
 
 
-def labelize_articles(articles: list[dict]) -> list[dict]:
+def labelize_articles(
+    articles: list[dict],
+    batch_size: int | None = None,
+    db: Session | None = None,
+    detectors: list[tuple] | None = None,
+) -> list[dict]:
     """Go through a batch of articles, labelize article as fake / real
 
+    Every field of every article is sent to the detectors at once, the batch
+    inference engine groups them by length into micro-batches. The results of
+    every detector are kept in `detections`, with the cascade stage which
+    produced them, the detection columns of the article hold the results of
+    the first detector. With a session, near-duplicates of a stored article or
+    of an article of the batch are not scored, they reuse the results of their
+    canonical article.
+
     Args:
         articles (list[dict]): batch of articles data in a json format
+        batch_size (int, optional): size of the inference micro-batches
+        db (Session, optional): session of the persistent inference cache and
+            of the near-duplicate index
+        detectors (list[tuple], optional): (model name, pipeline) of each detector.
+            Defaults to the detectors of the registry.
 
     Returns:
         list[dict]: list of labelized articles metadata
     """
-    labelized_articles = []
-    # LLM Detector pipeline
-    models = [
-        # (
-        #     "roberta-base-openai-detector",
-        #     pipeline("text-classification", model="roberta-base-openai-detector"),
-        # ),
-        (
-            "Hello-SimpleAI-chatgpt-detector-roberta",
-            pipeline(
-                "text-classification", model="Hello-SimpleAI/chatgpt-detector-roberta"
-            ),
-        ),
+    # LLM Detector pipelines are loaded once per process by the registry
+    models = detectors or model_registry.get_detectors()
+    model_names = [model_name for model_name, _ in models]
+    matches = {}
+    if db is not None and near_duplicates.is_enabled():
+        matches = near_duplicates.find_near_duplicates(db, articles)
+    stored_detections = {}
+    if matches:
+        stored_detections = crud.get_detection_results(
+            db,
+            [
+                match["article_id"]
+                for match in matches.values()
+                if match["batch_index"] is None
+            ],
+        )
+    reused = {}
+    for index, match in matches.items():
+        if match["batch_index"] is not None:
+            # Copied once the canonical article of the batch is scored
+            reused[index] = None
+        elif match["article_id"] in stored_detections:
+            detections = _reused_detections(
+                stored_detections[match["article_id"]], model_names
+            )
+            if detections is not None:
+                reused[index] = detections
+        # Articles scored on their own are not counted as near-duplicates
+        if index in reused:
+            articles[index]["near_duplicate_of"] = match["article_id"]
+            articles[index]["near_duplicate_similarity"] = match["similarity"]
+    scored_articles = [
+        article for index, article in enumerate(articles) if index not in reused
+    ]
+    texts = [
+        article.get(text_key)
+        for article in scored_articles
+        for text_key in ARTICLE_FIELDS.values()
     ]
-    for _, pipe in models:
-        for article in articles:
-            enriched_metadata = enrich_article(article, pipe)
-            article.update(enriched_metadata)
-            labelized_articles.append(article)
-    return labelized_articles
+    detections = detect_texts(texts, models, batch_size, db)
+    for article in scored_articles:
+        article["detections"] = {model_name: {} for model_name in model_names}
+    for model_name in model_names:
+        # Scatter the detections back in the order the texts were gathered
+        model_detections = iter(detections[model_name])
+        for article in scored_articles:
+            for field in ARTICLE_FIELDS:
+                article["detections"][model_name][field] = next(model_detections)
+    for index, detections in reused.items():
+        if detections is None:
+            canonical = articles[matches[index]["batch_index"]]
+            detections = _reused_detections(canonical["detections"], model_names)
+        articles[index]["detections"] = detections
+    primary_model_name = model_names[0]
+    for article in articles:
+        article["detection_model"] = primary_model_name
+        for field in ARTICLE_FIELDS:
+            detection = article["detections"][primary_model_name][field]
+            article[f"{field}_detection_label"] = detection["label"]
+            article[f"{field}_detection_score"] = detection["score"]
+    monitoring.count_articles("labelized", len(scored_articles))
+    monitoring.count_articles("near_duplicates", len(reused))
+    return articles
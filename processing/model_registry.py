@@ -0,0 +1,139 @@
+import os
+import threading
+
+# Comma separated list of huggingface model ids used as detectors
+DEFAULT_DETECTORS = "Hello-SimpleAI/chatgpt-detector-roberta"
+DETECTOR_MODELS = [
+    model_name.strip()
+    for model_name in os.getenv("DETECTOR_MODELS", DEFAULT_DETECTORS).split(",")
+    if model_name.strip()
+]
+# Cheap detector scoring every text first when the cascade is enabled
+CASCADE_FIRST_STAGE_MODEL = os.getenv("CASCADE_FIRST_STAGE_MODEL", "").strip() or None
+# Every model loaded at startup
+REGISTERED_MODELS = DETECTOR_MODELS + (
+    [CASCADE_FIRST_STAGE_MODEL] if CASCADE_FIRST_STAGE_MODEL else []
+)
+# Labels returned by the supported detectors
+FAKE_LABELS = {"Fake", "ChatGPT"}
+REAL_LABELS = {"Real", "Human"}
+WARM_UP_DETECTORS = os.getenv("WARM_UP_DETECTORS", "true").lower() == "true"
+WARM_UP_TEXT = "Warming up the detector before serving the first request."
+
+_pipelines = {}
+_errors = {}
+_lock = threading.Lock()
+_loading_thread = None
+
+
+def label_group(label: str | None) -> str | None:
+    """Return "fake" or "real" for a label of a supported detector, else None"""
+    if label in FAKE_LABELS:
+        return "fake"
+    if label in REAL_LABELS:
+        return "real"
+    return None
+
+
+def check_labels(model_name: str, pipe):
+    """Raise a ValueError when the detector returns labels outside of the label map"""
+    unknown_labels = {
+        label for label in pipe.config.id2label.values() if label_group(label) is None
+    }
+    if unknown_labels:
+        raise ValueError(
+            f"{model_name} returns unknown labels {sorted(unknown_labels)}, "
+            f"expected some of {sorted(FAKE_LABELS | REAL_LABELS)}"
+        )
+
+
+def _build_pipeline(model_name: str):
+    # Backends import transformers lazily, it takes seconds and is only needed for inference
+    from . import inference_backends
+
+    return inference_backends.load_detector(model_name)
+
+
+def get_pipeline(model_name: str):
+    """Return the shared pipeline of a detector, loading it on first use
+
+    Args:
+        model_name (str): huggingface model id of the detector
+
+    Returns:
+        Pipeline: text classification pipeline shared across the process
+    """
+    pipe = _pipelines.get(model_name)
+    if pipe is not None:
+        return pipe
+    with _lock:
+        # Another thread may have loaded the model while waiting for the lock
+        if model_name not in _pipelines:
+            try:
+                pipe = _build_pipeline(model_name)
+                # The cascade routes texts on the probability of the fake labels
+                if model_name == CASCADE_FIRST_STAGE_MODEL:
+                    check_labels(model_name, pipe)
+                if WARM_UP_DETECTORS:
+                    pipe(WARM_UP_TEXT)
+            except Exception as error:
+                _errors[model_name] = repr(error)
+                raise
+            _errors.pop(model_name, None)
+            _pipelines[model_name] = pipe
+    return _pipelines[model_name]
+
+
+def get_detectors(model_names: list[str] | None = None) -> list[tuple]:
+    """Return the configured detectors as (model name, pipeline) pairs
+
+    Args:
+        model_names (list[str], optional): subset of detectors. Defaults to DETECTOR_MODELS.
+
+    Returns:
+        list[tuple]: detectors ready for inference
+    """
+    model_names = model_names or DETECTOR_MODELS
+    return [(model_name, get_pipeline(model_name)) for model_name in model_names]
+
+
+def load_detectors(model_names: list[str] | None = None):
+    """Load and warm up every configured detector, errors are kept for the status"""
+    for model_name in model_names or REGISTERED_MODELS:
+        try:
+            get_pipeline(model_name)
+        except Exception:
+            continue
+
+
+def load_detectors_in_background(model_names: list[str] | None = None):
+    """Start loading the detectors without blocking the caller"""
+    global _loading_thread
+    if _loading_thread is not None and _loading_thread.is_alive():
+        return
+    _loading_thread = threading.Thread(
+        target=load_detectors, args=(model_names,), daemon=True
+    )
+    _loading_thread.start()
+
+
+def is_ready(model_names: list[str] | None = None) -> bool:
+    return all(
+        model_name in _pipelines for model_name in model_names or REGISTERED_MODELS
+    )
+
+
+def registry_status() -> dict:
+    return {
+        "ready": is_ready(),
+        "loading": _loading_thread is not None and _loading_thread.is_alive(),
+        "detectors": {
+            model_name: (
+                "loaded"
+                if model_name in _pipelines
+                else "error" if model_name in _errors else "pending"
+            )
+            for model_name in REGISTERED_MODELS
+        },
+        "errors": dict(_errors),
+    }
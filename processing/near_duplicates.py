@@ -0,0 +1,179 @@
+import hashlib
+import os
+import re
+import zlib
+from sqlalchemy.orm import Session
+from database import crud
+
+NEAR_DUPLICATE_DETECTION = (
+    os.getenv("NEAR_DUPLICATE_DETECTION", "true").lower() == "true"
+)
+# Estimated Jaccard similarity from which an article is a near-duplicate
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv("NEAR_DUPLICATE_THRESHOLD", "0.8"))
+# Changing these invalidates the stored signatures and bands
+MINHASH_PERMUTATIONS = 128
+LSH_BANDS = 32
+SHINGLE_SIZE = 3
+MINHASH_SEED = 1
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+WORD_PATTERN = re.compile(r"\w+")
+
+_permutations = None
+
+
+def is_enabled() -> bool:
+    return NEAR_DUPLICATE_DETECTION
+
+
+def _get_permutations():
+    # Drawn from a fixed seed, signatures stay comparable across processes
+    global _permutations
+    if _permutations is None:
+        import numpy as np
+
+        generator = np.random.RandomState(MINHASH_SEED)
+        _permutations = (
+            generator.randint(1, _MERSENNE_PRIME, MINHASH_PERMUTATIONS, np.uint64),
+            generator.randint(0, _MERSENNE_PRIME, MINHASH_PERMUTATIONS, np.uint64),
+        )
+    return _permutations
+
+
+def shingle(text: str, size: int = SHINGLE_SIZE) -> set[str]:
+    """Return the sets of `size` consecutive lowercase words of a text"""
+    words = WORD_PATTERN.findall(text.lower())
+    if len(words) <= size:
+        return {" ".join(words)} if words else set()
+    return {
+        " ".join(words[index : index + size]) for index in range(len(words) - size + 1)
+    }
+
+
+def minhash_signature(shingles: set[str]):
+    """Return the MinHash signature of a set of shingles as a uint32 numpy array"""
+    import numpy as np
+
+    multipliers, increments = _get_permutations()
+    hashes = np.fromiter(
+        (zlib.crc32(shingle.encode("UTF-8")) for shingle in shingles),
+        dtype=np.uint64,
+        count=len(shingles),
+    )
+    # Universal hashing (a * x + b) mod p, truncated to 32 bits
+    permuted = (np.outer(hashes, multipliers) + increments) % _MERSENNE_PRIME
+    return (permuted & _MAX_HASH).min(axis=0).astype(np.uint32)
+
+
+def lsh_band_keys(signature) -> list[str]:
+    """Hash each band of rows of the signature, similar articles share at least one"""
+    rows = len(signature) // LSH_BANDS
+    return [
+        f"{band}:"
+        + hashlib.blake2b(
+            signature[band * rows : (band + 1) * rows].tobytes(), digest_size=8
+        ).hexdigest()
+        for band in range(LSH_BANDS)
+    ]
+
+
+def estimate_similarity(signature, other_signature) -> float:
+    return float((signature == other_signature).mean())
+
+
+def _article_text(article: dict) -> str:
+    return " ".join(
+        article.get(key) or ""
+        for key in ("article_title", "article_description", "article_content")
+    )
+
+
+def find_near_duplicates(db: Session, articles: list[dict]) -> dict[int, dict]:
+    """Index a batch of articles and find those which are near-duplicates of another
+
+    The signature and band keys of each article are set on it, to be stored along
+    with it. Candidates sharing a band, among the stored articles and the earlier
+    articles of the batch, are kept when their estimated similarity reaches
+    NEAR_DUPLICATE_THRESHOLD. Near-duplicates are linked to the canonical article
+    of their match, never to another near-duplicate.
+
+    Args:
+        db (Session): session to the database holding the lsh index
+        articles (list[dict]): pre-processed articles metadata
+
+    Returns:
+        dict[int, dict]: per index of near-duplicate article, the `article_id` of
+        its canonical article, the `similarity` and the `batch_index` of the
+        canonical article when it is in the batch, else None
+    """
+    import numpy as np
+
+    signatures = {}
+    for index, article in enumerate(articles):
+        shingles = shingle(_article_text(article))
+        # Articles without text would all look alike
+        if not shingles:
+            continue
+        signature = minhash_signature(shingles)
+        signatures[index] = signature
+        article["minhash_signature"] = signature.astype("<u4").tobytes()
+        article["lsh_band_keys"] = lsh_band_keys(signature)
+    stored_candidates = crud.get_lsh_candidates(
+        db,
+        sorted(
+            {
+                band_key
+                for index in signatures
+                for band_key in articles[index]["lsh_band_keys"]
+            }
+        ),
+    )
+    candidate_ids = sorted(
+        {article_id for ids in stored_candidates.values() for article_id in ids}
+    )
+    stored_signatures = {
+        article_id: np.frombuffer(signature, dtype="<u4")
+        for article_id, signature in crud.get_minhash_signatures(
+            db, candidate_ids
+        ).items()
+    }
+    stored_links = crud.get_near_duplicate_links(db, candidate_ids)
+    batch_bands = {}
+    matches = {}
+    for index, signature in signatures.items():
+        band_keys = articles[index]["lsh_band_keys"]
+        best = None
+        for article_id in {
+            article_id
+            for band_key in band_keys
+            for article_id in stored_candidates.get(band_key, [])
+        }:
+            candidate = stored_signatures.get(article_id)
+            if candidate is None or len(candidate) != len(signature):
+                continue
+            similarity = estimate_similarity(signature, candidate)
+            if best is None or similarity > best["similarity"]:
+                canonical_id = stored_links.get(article_id, article_id)
+                best = {
+                    "article_id": canonical_id,
+                    "similarity": similarity,
+                    "batch_index": None,
+                }
+        for batch_index in {
+            batch_index
+            for band_key in band_keys
+            for batch_index in batch_bands.get(band_key, [])
+        }:
+            similarity = estimate_similarity(signature, signatures[batch_index])
+            if best is None or similarity > best["similarity"]:
+                # A near-duplicate of a near-duplicate points to the same canonical
+                best = matches.get(batch_index) or {
+                    "article_id": articles[batch_index]["article_id"],
+                    "batch_index": batch_index,
+                }
+                best = {**best, "similarity": similarity}
+        if best is not None and best["similarity"] >= NEAR_DUPLICATE_THRESHOLD:
+            matches[index] = best
+        for band_key in band_keys:
+            batch_bands.setdefault(band_key, []).append(index)
+    return matches
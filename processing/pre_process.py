@@ -1,8 +1,21 @@
-from transformers import pipeline
+import os
 import re
 from datetime import datetime
 import hashlib
-from datetime import datetime
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# Query parameters added by sharing and ad campaigns, they do not identify an article
+TRACKING_PARAMETERS = {"cmpid", "fbclid", "gclid", "mc_cid", "mc_eid", "ref", "smid"}
+CHARS_COUNTER_PATTERN = re.compile(r"\[\+\d+ chars\]")
+PUBLICATION_DATE_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+# Batches from this size are pre-processed column by column, see benchmarks.bench crossover
+COLUMNAR_MIN_BATCH_SIZE = int(os.getenv("PRE_PROCESS_COLUMNAR_MIN_BATCH_SIZE", "1000"))
+# Fields which must hold a value for an article to be kept
+REQUIRED_FIELDS = ["title", "description", "content", "publishedAt", "url"]
+# Urls canonicalized column-wise: http(s), without query, fragment or unusual characters
+SIMPLE_URL_PATTERN = re.compile(
+    r"^(?:https?)://([^/?#\[\]\s\x00-\x1f]*)([^?#\s\x00-\x1f]*)$", re.I
+)
 
 
 def value_was_removed(value: str) -> bool:
@@ -14,14 +27,69 @@ def value_has_none_string(value: str) -> bool:
 
 
 def clean_article_metadata(text: str) -> str:
-    chars_counter_pattern = r"\[\+\d+ chars\]"
-    cleaned_text = re.sub(chars_counter_pattern, "", text)
+    cleaned_text = CHARS_COUNTER_PATTERN.sub("", text)
     return cleaned_text.replace("\r\n", "")
 
 
-def generate_article_id(source: str, title: str, publish_date: str) -> str:
-    ingestion_date = datetime.today()
-    id = f"{ingestion_date}|{publish_date}|{source}|{title}"
+def canonicalize_url(url: str) -> str:
+    """Normalize an article url so the same article always gets the same url
+
+    Args:
+        url (str): url of the article returned by the news api
+
+    Returns:
+        str: url with a lowercase https scheme and host, without tracking
+        parameters, fragment or trailing slash
+    """
+    parts = urlsplit(url.strip())
+    scheme = "https" if parts.scheme.lower() in ("http", "https") else parts.scheme
+    query = [
+        (key, value)
+        for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith("utm_") and key.lower() not in TRACKING_PARAMETERS
+    ]
+    return urlunsplit(
+        (
+            scheme.lower(),
+            parts.netloc.lower(),
+            parts.path.rstrip("/") or "/",
+            urlencode(sorted(query)),
+            "",
+        )
+    )
+
+
+def canonicalize_urls(urls) -> list[str]:
+    """Column version of canonicalize_url
+
+    Args:
+        urls (pd.Series): urls of the articles
+
+    Returns:
+        list[str]: canonical url of each article, the same as canonicalize_url
+    """
+    parts = urls.str.strip().str.extract(SIMPLE_URL_PATTERN)
+    canonical_urls = (
+        "https://" + parts[0].str.lower() + parts[1].str.rstrip("/").replace("", "/")
+    )
+    # Urls with a query or anything unusual go through urllib
+    return [
+        canonical_url if isinstance(canonical_url, str) else canonicalize_url(url)
+        for canonical_url, url in zip(canonical_urls.tolist(), urls.tolist())
+    ]
+
+
+def hash_article_ids(canonical_urls, sources, publish_dates) -> list[str]:
+    """Column version of generate_article_id, from the canonical urls"""
+    return [
+        hashlib.sha256(f"{url}|{source}|{publish_date}".encode("UTF-8")).hexdigest()
+        for url, source, publish_date in zip(canonical_urls, sources, publish_dates)
+    ]
+
+
+def generate_article_id(source: str, url: str, publish_date: str) -> str:
+    # The id only depends on the article so every sync generates the same one
+    id = f"{canonicalize_url(url)}|{source}|{publish_date}"
     m = hashlib.sha256(id.encode("UTF-8"))
     return m.hexdigest()
 
@@ -39,22 +107,11 @@ def article_data_is_complete(article: dict) -> bool:
     if value_was_removed(article.get("source").get("name")):
         return None
     # If Missing field and None string do not retain article
-    if any(
-        list(
-            map(
-                lambda x: x is None or value_has_none_string(x),
-                [
-                    article.get("title"),
-                    article.get("description"),
-                    article.get("content"),
-                    article.get("publishedAt"),
-                ],
-            )
-        )
-    ):
-        return False
-    else:
-        return True
+    for field in REQUIRED_FIELDS:
+        value = article.get(field)
+        if value is None or value_has_none_string(value):
+            return False
+    return True
 
 
 def prepare_metadata(searched_keywords: str, article: dict) -> dict:
@@ -75,12 +132,12 @@ def prepare_metadata(searched_keywords: str, article: dict) -> dict:
     # Generate a unique id to store the article into the DB
     article_id = generate_article_id(
         article_source,
-        article_title,
+        article_url,
         article_publication_date,
     )
     # Transform date format from ISO 8601 to sqlalchemy compatible format
     article_publication_date = datetime.strptime(
-        article.get("publishedAt"), "%Y-%m-%dT%H:%M:%SZ"
+        article.get("publishedAt"), PUBLICATION_DATE_FORMAT
     )
 
     return {
@@ -99,15 +156,103 @@ def select_and_prepare_articles(
     searched_keywords: str, articles: list[dict]
 ) -> list[dict]:
     """Go through a batch of articles, remove articles with uncomplete data and clean metadata
+
+    Large batches go through the columnar path, which gives the same articles.
+
     Args:
         articles (list[dict]): batch of articles data in a json format
 
     Returns:
         list[dict]: skimmed  batch of articles
     """
+    if len(articles) >= COLUMNAR_MIN_BATCH_SIZE:
+        return select_and_prepare_articles_columnar(searched_keywords, articles)
+    return select_and_prepare_articles_rows(searched_keywords, articles)
+
+
+def select_and_prepare_articles_rows(
+    searched_keywords: str, articles: list[dict]
+) -> list[dict]:
+    """Row by row version of select_and_prepare_articles"""
     selected_articles = []
     for article in articles:
         if article_data_is_complete(article):
             article_metadata = prepare_metadata(searched_keywords, article)
             selected_articles.append(article_metadata)
     return selected_articles
+
+
+def select_and_prepare_articles_columnar(
+    searched_keywords: str, articles: list[dict]
+) -> list[dict]:
+    """Column by column version of select_and_prepare_articles
+
+    The batch is loaded in a DataFrame, filtering, cleaning and date parsing
+    are vectorized string and datetime operations on whole columns.
+
+    Args:
+        searched_keywords (str): keywords the articles were searched with
+        articles (list[dict]): batch of articles data in a json format
+
+    Returns:
+        list[dict]: the articles select_and_prepare_articles_rows returns
+    """
+    import pandas as pd
+
+    if not articles:
+        return []
+    frame = pd.DataFrame(
+        {
+            "source": [article.get("source").get("name") for article in articles],
+            **{
+                field: [article.get(field) for article in articles]
+                for field in REQUIRED_FIELDS
+            },
+        },
+        dtype=object,
+    )
+    # Same rules as article_data_is_complete, find returns NaN on missing values
+    is_complete = ~(frame["source"].str.find("Removed") > 0)
+    for field in REQUIRED_FIELDS:
+        is_complete &= frame[field].notna() & ~(frame[field].str.find("None") > 0)
+    frame = frame[is_complete]
+    if frame.empty:
+        return []
+    cleaned = {
+        field: frame[field]
+        .str.replace(CHARS_COUNTER_PATTERN, "", regex=True)
+        .str.replace("\r\n", "", regex=False)
+        .tolist()
+        for field in ("title", "description", "content")
+    }
+    article_ids = hash_article_ids(
+        canonicalize_urls(frame["url"]),
+        frame["source"].tolist(),
+        frame["publishedAt"].tolist(),
+    )
+    publication_dates = (
+        pd.to_datetime(frame["publishedAt"], format=PUBLICATION_DATE_FORMAT)
+        .dt.to_pydatetime()
+        .tolist()
+    )
+    return [
+        {
+            "article_id": article_id,
+            "article_source": source,
+            "article_publication_date": publication_date,
+            "article_url": url,
+            "article_title": title,
+            "article_description": description,
+            "article_content": content,
+            "searched_keywords": searched_keywords,
+        }
+        for article_id, source, url, publication_date, title, description, content in zip(
+            article_ids,
+            frame["source"].tolist(),
+            frame["url"].tolist(),
+            publication_dates,
+            cleaned["title"],
+            cleaned["description"],
+            cleaned["content"],
+        )
+    ]
@@ -0,0 +1,394 @@
+import asyncio
+import os
+import uuid
+from datetime import datetime, timedelta
+import monitoring
+from database import crud, database, writer
+from news_api import async_client, full_text
+from news_api.request_articles import NEWS_SOURCES_SELECTOR
+from . import labelize, pre_process
+
+# Number of items buffered between two stages before the producer waits
+SYNC_QUEUE_SIZE = int(os.getenv("SYNC_QUEUE_SIZE", "4"))
+# Number of articles sent together to the labelizer
+SYNC_LABELIZE_BATCH_SIZE = int(os.getenv("SYNC_LABELIZE_BATCH_SIZE", "64"))
+# Number of articles stored per transaction
+SYNC_COMMIT_CHUNK_SIZE = int(os.getenv("SYNC_COMMIT_CHUNK_SIZE", "200"))
+# Fetch only the articles published since the last sync, newest first
+SYNC_INCREMENTAL = os.getenv("SYNC_INCREMENTAL", "true").lower() == "true"
+# Minutes fetched again before a watermark, for the articles the news api indexes late
+SYNC_WATERMARK_OVERLAP = timedelta(
+    minutes=float(os.getenv("SYNC_WATERMARK_OVERLAP_MINUTES", "60"))
+)
+MAX_JOBS_KEPT = 100
+
+_DONE = object()
+
+
+class SyncJob:
+    """State and progress of a sync running in the background"""
+
+    def __init__(self, keywords: list[str], language: str, max_pages: int):
+        self.id = uuid.uuid4().hex
+        self.keywords = keywords
+        self.language = language
+        self.max_pages = max_pages
+        self.status = "pending"
+        self.error = None
+        self.created_at = datetime.utcnow()
+        self.finished_at = None
+        # Newest publication date seen per keyword, and the keywords whose new
+        # articles were all fetched, only those move their watermark forward
+        self.watermarks = {}
+        self.newest_publication_dates = {}
+        self.caught_up_keywords = set()
+        # (article id, keywords) of the articles also returned by another search,
+        # recorded once the article is stored
+        self.pending_memberships = []
+        self.progress = {
+            "pages_fetched": 0,
+            "pages_already_stored": 0,
+            "articles_fetched": 0,
+            "articles_selected": 0,
+            "articles_already_stored": 0,
+            "articles_full_text_fetched": 0,
+            "articles_labelized": 0,
+            "articles_stored": 0,
+        }
+        self.task = None
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "error": self.error,
+            "keywords": self.keywords,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "progress": self.progress,
+        }
+
+
+_jobs: dict[str, SyncJob] = {}
+
+
+def _in_read_session(query, *args):
+    # The session is created and closed by the worker thread using it, a cancelled
+    # stage does not stop the thread and must not close the session under its query
+    db = database.ReadSessionLocal()
+    try:
+        return query(db, *args)
+    finally:
+        db.close()
+
+
+def _labelize_in_session(db, articles: list[dict]) -> list[dict]:
+    return labelize.labelize_articles(articles, db=db)
+
+
+async def _fetch_stage(job: SyncJob, output: asyncio.Queue):
+    client = async_client.get_client()
+
+    async def fetch_keyword(keywords: str):
+        async for response in client.iter_pages(keywords, job.language, job.max_pages):
+            if response["status"] == "error":
+                raise RuntimeError(response["message"])
+            job.progress["pages_fetched"] += 1
+            job.progress["articles_fetched"] += len(response["articles"])
+            monitoring.count_articles("fetched", len(response["articles"]))
+            await output.put((keywords, response["articles"], None))
+
+    await asyncio.gather(*[fetch_keyword(keywords) for keywords in job.keywords])
+    await output.put(_DONE)
+
+
+async def _incremental_fetch_stage(job: SyncJob, output: asyncio.Queue):
+    client = async_client.get_client()
+    job.watermarks = await asyncio.to_thread(
+        _in_read_session,
+        crud.get_sync_watermarks,
+        job.keywords,
+        NEWS_SOURCES_SELECTOR,
+    )
+
+    async def fetch_keyword(keywords: str):
+        # Pages are fetched one after the other, the next one is only requested
+        # when the pre-processing found new articles in the previous one
+        watermark = job.watermarks.get(keywords)
+        from_date = watermark - SYNC_WATERMARK_OVERLAP if watermark else None
+        for page in range(1, job.max_pages + 1):
+            response = await client.fetch_page(
+                query=keywords,
+                language=job.language,
+                page=page,
+                from_date=from_date,
+                sort_by="publishedAt",
+            )
+            if response["status"] == "error":
+                raise RuntimeError(response["message"])
+            job.progress["pages_fetched"] += 1
+            job.progress["articles_fetched"] += len(response["articles"])
+            monitoring.count_articles("fetched", len(response["articles"]))
+            page_is_known = asyncio.get_running_loop().create_future()
+            await output.put((keywords, response["articles"], page_is_known))
+            # Older pages are already stored
+            if await page_is_known:
+                job.progress["pages_already_stored"] += 1
+                job.caught_up_keywords.add(keywords)
+                return
+            if page * async_client.ARTICLES_PER_PAGE >= response["totalResults"]:
+                job.caught_up_keywords.add(keywords)
+                return
+
+    await asyncio.gather(*[fetch_keyword(keywords) for keywords in job.keywords])
+    await output.put(_DONE)
+
+
+async def _pre_process_stage(job: SyncJob, input: asyncio.Queue, output: asyncio.Queue):
+    seen_ids = set()
+    # Articles stored by this sync were not stored before it started
+    synced_ids = set()
+    while (item := await input.get()) is not _DONE:
+        keywords, articles, page_is_known = item
+        # selection and cleaning of articles metadata, CPU bound on large pages
+        pre_processed_articles = await asyncio.to_thread(
+            pre_process.select_and_prepare_articles, keywords, articles
+        )
+        unique_articles = {}
+        for article in pre_processed_articles:
+            if article["article_id"] not in seen_ids:
+                unique_articles.setdefault(article["article_id"], article)
+        seen_ids.update(unique_articles)
+        if pre_processed_articles:
+            newest_publication_date = max(
+                article["article_publication_date"]
+                for article in pre_processed_articles
+            )
+            job.newest_publication_dates[keywords] = max(
+                newest_publication_date,
+                job.newest_publication_dates.get(keywords, newest_publication_date),
+            )
+        # Articles of the page fetched by another keyword of the sync may still
+        # be in flight, only those stored by earlier syncs make a page known
+        existing_ids = await asyncio.to_thread(
+            _in_read_session,
+            crud.get_existing_article_ids,
+            sorted({article["article_id"] for article in pre_processed_articles}),
+        )
+        new_articles = [
+            article
+            for article_id, article in unique_articles.items()
+            if article_id not in existing_ids
+        ]
+        new_ids = {article["article_id"] for article in new_articles}
+        synced_ids.update(new_ids)
+        job.pending_memberships += [
+            (article["article_id"], keywords)
+            for article in pre_processed_articles
+            if article["article_id"] not in new_ids
+        ]
+        job.progress["articles_selected"] += len(pre_processed_articles)
+        job.progress["articles_already_stored"] += len(
+            existing_ids & unique_articles.keys()
+        )
+        monitoring.count_articles(
+            "filtered", len(articles) - len(pre_processed_articles)
+        )
+        monitoring.count_articles(
+            "deduplicated", len(pre_processed_articles) - len(new_articles)
+        )
+        if page_is_known is not None:
+            page_is_known.set_result(
+                bool(pre_processed_articles)
+                and all(
+                    article["article_id"] in existing_ids
+                    and article["article_id"] not in synced_ids
+                    for article in pre_processed_articles
+                )
+            )
+        if new_articles:
+            await output.put(new_articles)
+    await output.put(_DONE)
+
+
+async def _full_text_stage(job: SyncJob, input: asyncio.Queue, output: asyncio.Queue):
+    fetcher = full_text.get_fetcher()
+    while (articles := await input.get()) is not _DONE:
+        job.progress["articles_full_text_fetched"] += await full_text.complete_articles(
+            fetcher, articles
+        )
+        await output.put(articles)
+    await output.put(_DONE)
+
+
+async def _labelize_stage(job: SyncJob, input: asyncio.Queue, output: asyncio.Queue):
+    pending_articles = []
+
+    async def flush():
+        # Inference is CPU bound, it runs in a thread to keep the event loop free
+        labelized_articles = await asyncio.to_thread(
+            _in_read_session, _labelize_in_session, pending_articles[:]
+        )
+        pending_articles.clear()
+        job.progress["articles_labelized"] += len(labelized_articles)
+        await output.put(labelized_articles)
+
+    while (articles := await input.get()) is not _DONE:
+        pending_articles += articles
+        if len(pending_articles) >= SYNC_LABELIZE_BATCH_SIZE:
+            await flush()
+    if pending_articles:
+        await flush()
+    await output.put(_DONE)
+
+
+def _write_articles(
+    connection, articles: list[dict], memberships: list[tuple[str, str]]
+) -> tuple[list[tuple[int, str]], list[dict], list[tuple[str, str]]]:
+    # Core connection, ingest does not need ORM objects nor an identity map
+    rows, chunk_reports = crud.bulk_insert_articles(connection, articles)
+    return rows, chunk_reports, crud.insert_article_keywords(connection, memberships)
+
+
+async def _store_articles(
+    articles: list[dict], memberships: list[tuple[str, str]]
+) -> tuple[list[tuple[int, str]], list[tuple[str, str]]]:
+    with monitoring.timed(
+        monitoring.DB_COMMIT_SECONDS, operation="sync_store_articles"
+    ):
+        rows, chunk_reports, pending_memberships = await writer.get_writer().run(
+            _write_articles, articles, memberships
+        )
+    crud.log_stored_articles(chunk_reports)
+    return rows, pending_memberships
+
+
+async def _persist_stage(job: SyncJob, input: asyncio.Queue):
+    pending_articles = []
+
+    async def commit():
+        memberships, job.pending_memberships = job.pending_memberships, []
+        stored_rows, pending_memberships = await _store_articles(
+            pending_articles[:], memberships
+        )
+        pending_articles.clear()
+        # Keywords of articles still going through the pipeline wait for them
+        job.pending_memberships += pending_memberships
+        job.progress["articles_stored"] += len(stored_rows)
+
+    while (articles := await input.get()) is not _DONE:
+        pending_articles += articles
+        # Commit in chunks so a failing sync keeps the work already done
+        if len(pending_articles) >= SYNC_COMMIT_CHUNK_SIZE:
+            await commit()
+    if pending_articles or job.pending_memberships:
+        await commit()
+
+
+async def _save_watermarks(job: SyncJob):
+    # Pages of the overlap only hold articles older than the watermark
+    watermarks = {
+        keywords: max(
+            newest_publication_date,
+            job.watermarks.get(keywords, newest_publication_date),
+        )
+        for keywords, newest_publication_date in job.newest_publication_dates.items()
+        if keywords in job.caught_up_keywords
+    }
+    await writer.get_writer().run(
+        crud.save_sync_watermarks, watermarks, NEWS_SOURCES_SELECTOR
+    )
+
+
+async def _traced_stage(name: str, stage):
+    with monitoring.span(f"sync_job.{name}"):
+        await stage
+
+
+def _start_stage(name: str, stage) -> asyncio.Future:
+    return asyncio.ensure_future(_traced_stage(name, stage))
+
+
+async def run_sync_job(job: SyncJob):
+    """Run the fetch, pre-process, full text, labelize and persist stages connected by bounded queues
+
+    The full text stage only runs when FETCH_FULL_TEXT is enabled. With
+    SYNC_INCREMENTAL, each keyword is fetched from its watermark and paging stops
+    at the first page whose articles are all stored. Watermarks only move forward
+    once every stage completed and for the keywords whose new articles were all
+    fetched, a sync cut by max_pages starts again from the same watermark.
+    """
+    # Stages are created within the span of the job, their spans are its children
+    with monitoring.span("sync_job", job_id=job.id, keywords=",".join(job.keywords)):
+        await _run_stages(job)
+
+
+async def _run_stages(job: SyncJob):
+    fetched_pages = asyncio.Queue(maxsize=SYNC_QUEUE_SIZE)
+    prepared_articles = asyncio.Queue(maxsize=SYNC_QUEUE_SIZE)
+    labelized_articles = asyncio.Queue(maxsize=SYNC_QUEUE_SIZE)
+    fetch_stage = _incremental_fetch_stage if SYNC_INCREMENTAL else _fetch_stage
+    stages = [
+        _start_stage("fetch", fetch_stage(job, fetched_pages)),
+        _start_stage(
+            "pre_process", _pre_process_stage(job, fetched_pages, prepared_articles)
+        ),
+    ]
+    if full_text.FETCH_FULL_TEXT:
+        completed_articles = asyncio.Queue(maxsize=SYNC_QUEUE_SIZE)
+        stages.append(
+            _start_stage(
+                "full_text",
+                _full_text_stage(job, prepared_articles, completed_articles),
+            )
+        )
+        prepared_articles = completed_articles
+    stages += [
+        _start_stage(
+            "labelize", _labelize_stage(job, prepared_articles, labelized_articles)
+        ),
+        _start_stage("persist", _persist_stage(job, labelized_articles)),
+    ]
+    job.status = "running"
+    try:
+        await asyncio.gather(*stages)
+        if SYNC_INCREMENTAL:
+            await _save_watermarks(job)
+        job.status = "completed"
+    except asyncio.CancelledError:
+        job.status = "cancelled"
+    except Exception as error:
+        job.status = "failed"
+        job.error = repr(error)
+    finally:
+        # A failing stage stops the others instead of leaving them waiting
+        for stage in stages:
+            stage.cancel()
+        job.finished_at = datetime.utcnow()
+
+
+def start_sync_job(keywords: list[str], language: str, max_pages: int) -> SyncJob:
+    """Schedule a sync on the running event loop and return its job right away"""
+    job = SyncJob(keywords, language, max_pages)
+    # Forget the oldest finished jobs
+    for job_id in list(_jobs)[: max(0, len(_jobs) - MAX_JOBS_KEPT + 1)]:
+        if _jobs[job_id].finished_at is not None:
+            del _jobs[job_id]
+    _jobs[job.id] = job
+    job.task = asyncio.ensure_future(run_sync_job(job))
+    return job
+
+
+def get_job(job_id: str) -> SyncJob | None:
+    return _jobs.get(job_id)
+
+
+def list_jobs() -> list[SyncJob]:
+    return list(_jobs.values())
+
+
+def cancel_job(job_id: str) -> SyncJob | None:
+    job = _jobs.get(job_id)
+    if job is not None and job.task is not None and not job.task.done():
+        job.task.cancel()
+    return job
@@ -0,0 +1,94 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1024"))
+RESPONSE_CACHE_MAX_BYTES = int(
+    os.getenv("RESPONSE_CACHE_MAX_BYTES", str(32 * 1024 * 1024))
+)
+
+
+def make_key(path: str, params: dict) -> str:
+    # Parameters left to their default do not change the response
+    normalized = sorted(
+        (key, str(value)) for key, value in params.items() if value is not None
+    )
+    return f"{path}?{json.dumps(normalized)}"
+
+
+def make_etag(key: str, data_version: str) -> str:
+    # The response only changes with the data, the etag is known before any query
+    digest = hashlib.sha1(f"{data_version}|{key}".encode("UTF-8")).hexdigest()
+    return f'"{digest}"'
+
+
+class ResponseCache:
+    """LRU of serialized responses, bounded by entries and bytes, valid for one data version"""
+
+    def __init__(
+        self,
+        max_entries: int = RESPONSE_CACHE_MAX_ENTRIES,
+        max_bytes: int = RESPONSE_CACHE_MAX_BYTES,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def _evict(self, key: str):
+        _, body, _ = self._entries.pop(key)
+        self._size -= len(body)
+
+    def get(self, key: str, data_version: str) -> tuple[bytes, dict] | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != data_version:
+                if entry is not None:
+                    self._evict(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1], entry[2]
+
+    def put(self, key: str, data_version: str, body: bytes, headers: dict):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._evict(key)
+            self._entries[key] = (data_version, body, headers)
+            self._size += len(body)
+            while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                self._evict(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def record_not_modified(self):
+        with self._lock:
+            self.not_modified += 1
+
+    def stats(self) -> dict:
+        requests = self.hits + self.misses + self.not_modified
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "memory_bytes": self._size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified,
+            "hit_rate": (self.hits + self.not_modified) / requests if requests else 0.0,
+        }
+
+
+response_cache = ResponseCache()